@@ -0,0 +1,96 @@
+# microbenchmark of the Language Filter matching, over synthetic track names
+#
+# usage (in /muzee):
+#   python -m scripts.bench_language_filter [--tracks 100000]
+
+import argparse
+import random
+import string
+import timeit
+
+from server.utils.langfilter import LanguageMatcher
+
+# the alphabet a user would paste in for keep_chars
+HEBREW_CHARS = "אבגדהוזחטיכלמנסעפצקרשתךםןףץ"
+
+
+def synthetic_tracks(count: int, seed: int = 0) -> list[tuple[str, str, str]]:
+    """(title, artists, album) tuples, 10% of them in hebrew"""
+
+    rnd = random.Random(seed)
+    latin = string.ascii_letters + "  "
+
+    def text(alphabet: str, length: int) -> str:
+        return "".join(rnd.choice(alphabet) for _ in range(length)).strip() or "x"
+
+    tracks = []
+
+    for _ in range(count):
+        alphabet = HEBREW_CHARS + " " if rnd.random() < 0.1 else latin
+        tracks.append(
+            (
+                text(alphabet, rnd.randint(5, 40)),
+                text(latin, rnd.randint(5, 25)),
+                text(latin, rnd.randint(5, 30)),
+            )
+        )
+
+    return tracks
+
+
+def current_loop(tracks, keep_chars: str) -> int:
+    """The original `any(c in keep_chars for c in name)`, titles only."""
+    return sum(any(c in keep_chars for c in title) for title, _, _ in tracks)
+
+
+def matcher_titles(tracks, matcher: LanguageMatcher) -> int:
+    return sum(matcher.match(title) for title, _, _ in tracks)
+
+
+def matcher_all_fields(tracks, matcher: LanguageMatcher) -> int:
+    return sum(matcher.match(*track) for track in tracks)
+
+
+def main(count: int, repeat: int):
+    tracks = synthetic_tracks(count)
+
+    chars_matcher = LanguageMatcher(chars=HEBREW_CHARS)
+    script_matcher = LanguageMatcher(scripts=["hebrew"])
+
+    # build cost, paid once per request
+    build = min(
+        timeit.repeat(
+            lambda: LanguageMatcher(scripts=["hebrew", "cjk"]), number=1, repeat=repeat
+        )
+    )
+
+    cases = {
+        "current loop (titles)": lambda: current_loop(tracks, HEBREW_CHARS),
+        "matcher, chars (titles)": lambda: matcher_titles(tracks, chars_matcher),
+        "matcher, script (titles)": lambda: matcher_titles(tracks, script_matcher),
+        "matcher, script (title+artists+album)": lambda: matcher_all_fields(
+            tracks, script_matcher
+        ),
+    }
+
+    print(f"{count} tracks, best of {repeat}, matcher build: {build * 1e6:.0f}us")
+
+    baseline = None
+
+    for name, case in cases.items():
+        matched = case()
+        best = min(timeit.repeat(case, number=1, repeat=repeat))
+        baseline = baseline or best
+
+        print(
+            f"{name:<40} {best * 1000:8.1f}ms  {baseline / best:5.1f}x  matched {matched}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Language Filter microbenchmark")
+    parser.add_argument("--tracks", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    main(args.tracks, args.repeat)
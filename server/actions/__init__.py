@@ -1,5 +1,5 @@
 from .generate_playlist import run_generate_playlist
-from .daily_smash import run_daily_smash
+from .daily_smash import run_daily_smash, run_scheduled_daily_smash
 from .public_liked import run_public_liked
 from .live_weather import run_live_weather
 from .liked_archive import run_liked_archive
@@ -1,9 +1,15 @@
 import itertools
 import logging
 import random
+from datetime import datetime, timedelta, timezone
 
 from server.models.context import Context
 from server.utils.decos import use_spotify
+from server.utils.library_pool import LibraryPool
+from server.utils.spotify import CantRefresh
+
+# a failed scheduled smash is retried after this delay (at most until its next regular run)
+RETRY_DELAY = timedelta(minutes=15)
 
 
 @use_spotify
@@ -36,14 +42,22 @@ async def run_daily_smash(ctx: Context, create: bool = False):
     if len(playlists) == 0:  # nothing to work with
         return ds_playlist_id if create else None
 
+    # the playlists' songs, saved by snapshot
+    pool = await LibraryPool(ctx).load(playlists)
+
     random.shuffle(playlists)
     source_playlists_iter = itertools.cycle(playlists)
 
     songs = set()
     empty_tries = 0
 
+    # picks in a row that added no new song. the cached playlists never await,
+    # so a library smaller than songs_count must end the loop by itself
+    # (after 3 passes over the playlists, the slices are random)
+    stale_tries = 0
+
     while len(songs) < (songs_count := ctx.user.ds_songs_count):
-        if empty_tries > 3:  # give up
+        if empty_tries > 3 or stale_tries >= 3 * len(playlists):  # give up
             break
 
         playlist = next(source_playlists_iter)
@@ -52,41 +66,28 @@ async def run_daily_smash(ctx: Context, create: bool = False):
             10, max(2, random.randint(-10, 10) + songs_count // len(playlists))
         )
 
-        # get playlist songs count
-        resp = await ctx.sc.get(f"playlists/{playlist.id}", fields="tracks.total")
-        playlist_songs_count = resp["tracks"]["total"]
+        # get the playlist songs (re-read only if the playlist changed)
+        uris = await pool.uris(playlist)
 
-        if playlist_songs_count == 0:
+        if len(uris) == 0:
             empty_tries += 1
+            stale_tries += 1
             continue
 
-        take_offset = random.randint(0, max(0, playlist_songs_count - take_songs))
-
-        # get songs from playlist
-        resp = await ctx.sc.get(
-            f"playlists/{playlist.id}/tracks",
-            limit=min(50, take_songs),
-            fields="items(is_local,track(uri,type))",
-            offset=take_offset,
-        )
+        take_offset = random.randint(0, max(0, len(uris) - take_songs))
+        take_uris = uris[take_offset : take_offset + min(50, take_songs)]
 
-        songs.update(
-            {
-                id
-                for t in resp["items"]
-                if (id := t["track"]["uri"]) is not None
-                and t["track"]["type"] == "track"
-                and not t["is_local"]
-            }
-        )
+        songs_before = len(songs)
+        songs.update(take_uris)
+        stale_tries = 0 if len(songs) > songs_before else stale_tries + 1
 
-        logging.info(f'+ Added {len(resp["items"])} songs from {playlist.name}')
+        logging.info(f"+ Added {len(take_uris)} songs from {playlist.name}")
 
-    # clear it
-    await ctx.sc.put(f"playlists/{ds_playlist_id}/tracks", uris=[], body=True)
+    await pool.save()
+    logging.info(f"Daily smash pool: re-read {pool.reads}/{len(playlists)} playlists")
 
-    # fill it
-    await ctx.sc.add_tracks_to_playlist(ds_playlist_id, list(songs)[:songs_count])
+    # fill it (replacing the old songs)
+    await ctx.sc.writer.replace(ds_playlist_id, list(songs)[:songs_count])
 
     # edit last update time
     await ctx.sc.edit_playlist(
@@ -108,3 +109,30 @@ async def run_daily_smash(ctx: Context, create: bool = False):
     )
 
     return ds_playlist_id
+
+
+async def run_scheduled_daily_smash(ctx: Context):
+    """
+    Run the Daily Smash of a user that is due, and schedule their next one.
+    The next run is scheduled whatever happens (failure, timeout...),
+    so a failing smash is retried every RETRY_DELAY and not on every tick.
+    """
+
+    next_run_at = ctx.user.ds_next_run()
+
+    if next_run_at is None:  # no time to run at, unschedule it
+        await ctx.db.set_ds_next_run(ctx.user, None)
+        return
+
+    # if the smash fails, retry it soon (but not after its next regular run)
+    scheduled_at = min(datetime.now(timezone.utc) + RETRY_DELAY, next_run_at)
+
+    try:
+        await run_daily_smash(ctx=ctx)
+        scheduled_at = next_run_at
+    except CantRefresh:
+        # the user revoked muzee, no point retrying before the next regular run
+        scheduled_at = next_run_at
+        raise
+    finally:
+        await ctx.db.set_ds_next_run(ctx.user, scheduled_at)
@@ -1,3 +1,4 @@
+import asyncio
 import random
 
 from server.models.context import Context
@@ -5,19 +6,28 @@ from server.utils.decos import use_spotify
 
 
 @use_spotify
-async def run_generate_playlist(ctx: Context, topics: list[str], songs_count: int):
+async def run_generate_playlist(
+    ctx: Context, topics: list[str], songs_count: int, window: int = 8
+):
     """
     🎲 Playlist Generator
 
     Create a random playlist based on a topic or a list of topics.
     The songs will be taken from playlists in the topic's search results.
+
+    The searches and the playlists' songs are fetched concurrently, `window` at a time.
     """
 
-    playlists = []
+    sem = asyncio.Semaphore(window)
+
+    async def search(topic: str) -> list[dict]:
+        async with sem:
+            resp = await ctx.sc.get("search", q=topic, type="playlist", limit=5)
+            return [p for p in resp["playlists"]["items"] if p is not None]
 
-    for topic in topics:
-        resp = await ctx.sc.get("search", q=topic, type="playlist", limit=5)
-        playlists += resp["playlists"]["items"]
+    playlists = [
+        p for results in await asyncio.gather(*map(search, topics)) for p in results
+    ]
 
     total_songs_available = sum(p["tracks"]["total"] for p in playlists)
 
@@ -29,25 +39,28 @@ async def run_generate_playlist(ctx: Context, topics: list[str], songs_count: in
 
     songs_per_playlist = (songs_count // len(playlists)) + 15
 
-    songs = set()
-
-    for p in playlists:
-        # get the songs
+    async def get_songs(p: dict) -> list[str]:
         offset = 0
 
         if (count := p["tracks"]["total"]) > songs_per_playlist:
             offset = random.randint(0, count - songs_per_playlist)
 
-        resp = await ctx.sc.get(
-            f'playlists/{p["id"]}/tracks',
-            playlist_id=p["id"],
-            limit=min(50, songs_per_playlist),
-            fields="items(track(uri))",
-            offset=offset,
-        )
+        async with sem:
+            resp = await ctx.sc.get(
+                f'playlists/{p["id"]}/tracks',
+                playlist_id=p["id"],
+                limit=min(50, songs_per_playlist),
+                fields="items(track(uri))",
+                offset=offset,
+            )
+
+        return [it["track"]["uri"] for it in resp["items"] if it["track"]]
+
+    # add the songs
+    songs = set()
 
-        # add the songs
-        songs |= set(it["track"]["uri"] for it in resp["items"])
+    for uris in await asyncio.gather(*map(get_songs, playlists)):
+        songs.update(uris)
 
     songs = list(songs)
     random.shuffle(songs)
@@ -63,7 +76,7 @@ async def run_generate_playlist(ctx: Context, topics: list[str], songs_count: in
     )
 
     # add the songs
-    await ctx.sc.playlist_add_tracks(resp.id, *songs)
+    await ctx.sc.writer.add(resp.id, songs)
 
     result = dict(
         id=resp.id,
@@ -2,6 +2,7 @@ import logging
 
 from server.models.context import Context
 from server.utils.decos import use_spotify
+from server.utils.liked_sync import LikedTableSync, TRACK_URI_PREFIX
 
 
 @use_spotify
@@ -25,9 +26,9 @@ async def run_liked_archive(ctx: Context, create: bool = False):
         )
 
         # save liked
-        liked = await ctx.sc.get_all_playlist_tracks("likedsongs")
-        liked = [t["track"]["uri"] for t in liked]
-        await ctx.db.save_cache(ctx.user, "liked_songs", liked)
+        sync = LikedTableSync(ctx, "liked_archive")
+        await sync.sync()
+        await sync.commit()
 
         await ctx.db.log_event(
             ctx.user,
@@ -38,30 +39,27 @@ async def run_liked_archive(ctx: Context, create: bool = False):
 
         return playlist.id
 
-    # pull the old liked songs from the database
-    old_liked = await ctx.db.load_cache(ctx.user, "liked_songs", default=list)
-
-    # get the user's liked songs count
-    # this is currently the best way to check if the playlist has changed,
-    # as spotify doesnt provide a snapshot_id for the liked songs playlist.
+    # sync the liked songs with the ones saved in the database.
+    # spotify doesnt provide a snapshot_id for the liked songs playlist,
+    # so the sync pages from the newest song until it reaches known songs.
     # tldr; spotify api is not perfect \_(ツ)_/¯
-    now_liked = [
-        t["track"]["uri"] for t in await ctx.sc.get_all_playlist_tracks("likedsongs")
-    ]
-
-    unliked = list(set(old_liked) - set(now_liked))
+    sync = LikedTableSync(ctx, "liked_archive")
+    liked = await sync.sync()
 
-    logging.info(f"Old liked: {len(old_liked)} | Now liked: {len(now_liked)}")
+    unliked = liked.removed
 
-    if now_liked != old_liked:
-        logging.info(f"liked songs have changed for {ctx.user.username}")
-        await ctx.db.save_cache(ctx.user, "liked_songs", now_liked)
+    logging.info(
+        f"Liked songs: +{len(liked.added)} -{len(unliked)} in {liked.requests} requests"
+    )
 
     if not unliked:
+        await sync.commit()
         return
 
-    # add the unliked songs to the archive
-    await ctx.sc.add_tracks_to_playlist(ctx.user.la_playlist, unliked)
+    # add the unliked songs to the archive, then save the liked songs
+    # (if adding fails, the next sync finds the same unliked songs)
+    await ctx.sc.writer.add(ctx.user.la_playlist, unliked)
+    await sync.commit()
     await ctx.db.log_event(
         ctx.user,
         "liked_archive",
@@ -70,7 +68,8 @@ async def run_liked_archive(ctx: Context, create: bool = False):
             request={
                 "playlist_id": ctx.user.la_playlist,
                 "create": create,
-                "added": unliked,
+                # track ids, the uris are the same but for the prefix
+                "added": [uri.removeprefix(TRACK_URI_PREFIX) for uri in unliked],
             }
         ),
     )
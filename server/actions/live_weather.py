@@ -1,8 +1,4 @@
-import itertools
 import logging
-import random
-
-import aiohttp
 
 from server.models.context import Context
 from server.utils.decos import use_spotify
@@ -29,9 +25,8 @@ async def run_live_weather(ctx: Context):
     url = f"https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/timeline/{ctx.user.lw_lat},{ctx.user.lw_lon}"
     params = dict(unitGroup="metric", key=api_key, contentType="json")
 
-    async with aiohttp.ClientSession() as cs:
-        async with cs.get(url, params=params) as resp:
-            js = await resp.json()
+    async with ctx.sessions.weather.get(url, params=params) as resp:
+        js = await resp.json()
 
     if not (cc := js.get("currentConditions")):
         logging.warning(
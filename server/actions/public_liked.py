@@ -1,5 +1,6 @@
 from server.models.context import Context
 from server.utils.decos import use_spotify
+from server.utils.liked_sync import LikedSync
 
 
 @use_spotify
@@ -12,6 +13,14 @@ async def run_public_liked(ctx: Context, create: bool = False):
 
     assert ctx.user.pl_playlist or create is True, "No playlist set for Public Liked."
 
+    # get the user's liked songs (only the new ones, if nothing was removed)
+    sync = LikedSync(ctx, "public_liked")
+    liked = await sync.sync()
+
+    if not create and not liked.changed:
+        await sync.commit()
+        return ctx.user.pl_playlist
+
     if create:
         playlist = await ctx.sc.create_playlist(
             user=ctx.user.spotify_id,
@@ -20,34 +29,38 @@ async def run_public_liked(ctx: Context, create: bool = False):
             public=True,
         )
         pl_playlist_id = playlist.id
+        mirror = []
     else:
         pl_playlist_id = ctx.user.pl_playlist
 
         # does it exist? no point to continue if we can't add songs to it.
-        js = await ctx.sc.get(f"playlists/{pl_playlist_id}", fields="id")
+        js = await ctx.sc.get(f"playlists/{pl_playlist_id}", fields="id,snapshot_id")
 
         if js.get("error"):
             return
 
-    # method: remove songs that are not in liked and add songs that are missing
+        # only muzee writes to it, so it's usually cached at its current snapshot
+        mirror = await ctx.sc.get_playlist_items(
+            pl_playlist_id, snapshot_id=js["snapshot_id"]
+        )
 
-    # get the user's liked songs
-    liked = await ctx.sc.get_all_playlist_tracks("likedsongs")
-    mirror = await ctx.sc.get_all_playlist_tracks(
-        pl_playlist_id, fields="items(is_local,track(type,uri))"
-    )
+    # method: remove songs that are not in liked and add songs that are missing
 
-    liked_uris = {t["track"]["uri"] for t in liked}
-    mirror_uris = {t["track"]["uri"] for t in mirror}
+    liked_uris = set(liked.uris)
+    mirror_uris = set(mirror)
 
     remove_uris = mirror_uris - liked_uris
     add_uris = liked_uris - mirror_uris
 
     if remove_uris:
-        await ctx.sc.delete_playlist_tracks(pl_playlist_id, list(remove_uris))
+        await ctx.sc.writer.remove(pl_playlist_id, list(remove_uris))
 
     if add_uris:
-        await ctx.sc.add_tracks_to_playlist(pl_playlist_id, list(add_uris))
+        await ctx.sc.writer.add(pl_playlist_id, list(add_uris))
+
+    # the playlist is in sync, save the liked songs state
+    # (saved before, a failed write would be forgotten by the next sync)
+    await sync.commit()
 
     if remove_uris or add_uris:
         # edit last update time
@@ -1,14 +1,12 @@
 import asyncio
-import copy
-from datetime import datetime
+import time
+from datetime import timedelta
 import aiocron
 import pydantic
-import pytz
 
 from sanic import Sanic, Blueprint, Request, json
 from sanic_ext import Extend
 
-import asyncpg
 from aiocache import SimpleMemoryCache
 
 import json as json_lib
@@ -21,13 +19,17 @@ from sanic_ext.exceptions import ValidationError
 from server.database import Database
 from server.models.user import User
 from server.models.context import Context
-from server.actions import (
-    run_daily_smash,
-    run_public_liked,
-    run_live_weather,
-    run_liked_archive,
-)
 from server.utils import spotify as sp
+from server.utils.tasks import TaskRunner, SweepResult
+from server.utils.sessions import Sessions
+from server.utils.progress import RunTracker
+from server.utils import timing
+from server.jobs import JobQueue, FEATURE_ACTIONS
+
+
+# how long a claimed Daily Smash may take (waiting for the runner / the jobs queue included)
+# before it's claimed again
+DAILY_SMASH_LEASE = timedelta(minutes=30)
 
 
 class Muzee:
@@ -43,6 +45,17 @@ class Muzee:
         self.config = config
 
         self.ctx: Context = None  # created in setup_hook
+        self.runner: TaskRunner = None  # created in setup_hook
+        self.queue: JobQueue | None = None  # created in setup_hook if jobs are enabled
+
+        # background runs of the endpoints (?async=1)
+        self.runs = RunTracker.from_config(config)
+
+        # Server-Timing header, and log the requests slower than slow_request seconds (0 = off)
+        self.server_timing = config.getboolean("timing", "server_timing", fallback=True)
+        self.slow_request = (
+            config.getfloat("timing", "slow_request_ms", fallback=0) / 1000
+        )
 
         # CORS for all origins. todo: change this to the website url
         app.config.CORS_ORIGINS = "*"
@@ -51,6 +64,11 @@ class Muzee:
         # register listeners for database connection
         self.register_listeners()
 
+        # request timing (db / spotify / app)
+        if self.server_timing or self.slow_request:
+            self.app.register_middleware(self.start_timing, "request")
+            self.app.register_middleware(self.end_timing, "response")
+
         ## Global Variables ##
         self.setup_globals(mode)
 
@@ -65,97 +83,117 @@ class Muzee:
             AssertionError, self.on_assertion_error
         )  # assertion errors
 
-    async def daily_smash_task(self):
+    async def dispatch(self, feature: str, users: list[User]) -> SweepResult | None:
         """
-        Task to run every 5 minutes and look for
-        daily smashes that need to be generated
+        Run the feature for the users.
+        When the jobs queue is enabled, the runs are queued for the workers instead (and None is returned).
         """
 
-        # i dont trust aiocron enough...
-        now = datetime.now(pytz.UTC)
-        rounded_minute = now.minute - (now.minute % 5)
-        rounded_now = now.replace(minute=rounded_minute, second=0, microsecond=0).time()
-
-        logging.info(f"daily smash task ({rounded_now.replace()} UTC)")
-
-        users = await self.ctx.db.pool.fetch(
-            """
-SELECT * FROM users
-WHERE
-  'daily-smash' = ANY(enabled_features)
-  AND ds_playlist IS NOT NULL
-  AND ds_songs_count > 0
-  AND ds_update_at = $1
-""",
-            rounded_now,
-        )
+        if self.queue is not None:
+            queued = await self.queue.enqueue(feature, [u.id for u in users])
+            logging.info(f"Queued {queued}/{len(users)} {feature} jobs")
+            return None
+
+        return await self.runner.run(feature, users, FEATURE_ACTIONS[feature])
+
+    async def daily_smash_task(self):
+        """
+        Task to run every minute and generate the daily smashes that are due.
+        Overdue smashes (late tick, restart...) are caught up.
+        The due users are claimed for a lease, each smash then schedules its next run
+        (also when it fails, see run_scheduled_daily_smash).
+        """
 
-        for raw_user in users:
-            ctx = copy.copy(self.ctx)
-            ctx.user = User(**raw_user)
+        users = await self.ctx.db.claim_due_daily_smash_users(DAILY_SMASH_LEASE)
 
-            logging.info(f"Running daily smash for {ctx.user.username}")
-            await run_daily_smash(ctx=ctx)
+        if not users:
+            return
 
-        # logging.info(f"DS users for {rounded_now.strftime('%H:%M')}:\n{'\n'.join(str(u) for u in users)}")
+        logging.info(f"daily smash task ({len(users)} due)")
+        await self.dispatch("daily-smash", users)
 
-    async def public_liked_task(self):
+    async def periodic_task(self, feature: str, period: int):
         """
-        Task to run every 30 minutes
-        and update the public liked playlists
+        Run the feature for the users whose phase is due this minute.
+
+        Every user gets a stable phase offset inside the `period` (see PHASE_SQL),
+        so each user still runs once per period but the load is spread evenly
+        over the period instead of bursting on the hour.
         """
 
-        users = await self.ctx.db.pool.fetch(
-            """
-SELECT * FROM users
-WHERE
-  'public-liked' = ANY(enabled_features)
-  AND pl_playlist IS NOT NULL
-"""
+        now = int(time.time() // 60)  # minutes since epoch (UTC)
+
+        # catch up on ticks that were missed (late tick, restart...), up to a whole period.
+        # the last tick is saved in the db, so it survives restarts
+        last = await self.ctx.db.advance_tick(feature, now)
+        last = now - 1 if last is None else last
+        phases = sorted(
+            {m % period for m in range(max(last + 1, now - period + 1), now + 1)}
         )
 
-        for raw_user in users:
-            ctx = copy.copy(self.ctx)
-            ctx.user = User(**raw_user)
+        if not phases:  # already ran for this minute
+            return
 
-            logging.info(f"Running public liked for {ctx.user.username}")
-            await run_public_liked(ctx=ctx)
+        users = await self.ctx.db.get_phase_users(feature, period, phases)
 
-    async def live_weather_task(self):
+        if users:
+            await self.dispatch(feature, users)
+
+    async def public_liked_task(self):
         """
-        Task to run every hour and update the live weather playlists
+        Task to run every minute and update the public liked playlists
+        (every user is updated once per 30 minutes)
         """
-        users = await self.ctx.db.pool.fetch(
-            """
-SELECT * FROM users
-WHERE
-  'live-weather' = ANY(enabled_features)
-  AND lw_playlist IS NOT NULL
-"""
-        )
+        await self.periodic_task("public-liked", period=30)
 
-        for raw_user in users:
-            ctx = copy.copy(self.ctx)
-            ctx.user = User(**raw_user)
-
-            logging.info(f"Running live weather for {ctx.user.username}")
-            await run_live_weather(ctx=ctx)
+    async def live_weather_task(self):
+        """
+        Task to run every minute and update the live weather playlists
+        (every user is updated once per hour)
+        """
+        await self.periodic_task("live-weather", period=60)
 
     async def liked_archive_task(self):
         """
-        Task to run every hour and update the liked archive playlists
+        Task to run every minute and update the liked archive playlists
+        (every user is updated once per hour)
+        """
+        await self.periodic_task("liked-archive", period=60)
+
+    async def events_task(self):
+        """
+        Task to run daily: create the next events partitions
+        and roll up the old ones (see Database.maintain_events)
         """
-        logging.info("liked archive task")
-        users = await self.ctx.db.pool.fetch(
-            """SELECT * FROM users WHERE 'liked-archive' = ANY(enabled_features)AND la_playlist IS NOT NULL"""
+        await self.ctx.db.maintain_events(
+            retention_months=self.config.getint(
+                "events", "retention_months", fallback=6
+            ),
+            months_ahead=self.config.getint("events", "months_ahead", fallback=2),
+            archive=self.config.getboolean("events", "archive", fallback=False),
         )
 
-        for raw_user in users:
-            ctx = copy.copy(self.ctx)
-            ctx.user = User(**raw_user)
+    async def start_timing(self, request: Request):
+        request.ctx.timing = timing.start(keep_calls=self.slow_request > 0)
+
+    async def end_timing(self, request: Request, response):
+        """Add the Server-Timing header, and log the request if it was slow."""
 
-            logging.info(f"Running liked archive for {ctx.user.username}")
-            await run_liked_archive(ctx=ctx)
+        request_timing: timing.RequestTiming = getattr(request.ctx, "timing", None)
+
+        if request_timing is None:
+            return
+
+        elapsed = request_timing.elapsed
+
+        if self.server_timing:
+            response.headers["Server-Timing"] = request_timing.header(elapsed)
+
+        if self.slow_request and elapsed >= self.slow_request:
+            logging.warning(
+                f"Slow request {request.method} {request.path} {elapsed * 1000:.0f}ms "
+                f"({request_timing.header(elapsed)}): {request_timing.breakdown()}"
+            )
 
     async def on_pydantic_error(self, request: Request, exception: ValidationError):
         exc: pydantic.ValidationError = exception.extra["exception"]
@@ -170,38 +208,44 @@ WHERE
     async def setup_hook(self, app: Sanic):
         logging.info("Setting up db connection")
 
-        pool = await asyncpg.create_pool(
-            user=self.config.get("database", "username"),
-            password=self.config.get("database", "password"),
-            database=self.config.get("database", "database"),
-        )
-
-        db_conn = Database(pool)
+        db_conn = await Database.connect(self.config)
         app.ctx.db = db_conn
 
-        spotify = sp.Spotify(
-            client_id=self.config.get("spotify", "client_id"),
-            client_secret=self.config.get("spotify", "client_secret"),
-            scope=self.config.get("spotify", "scope"),
-            server_url=app.ctx.SERVER_URL,
-            db=db_conn,
+        sessions = Sessions.from_config(self.config)
+        spotify = sp.Spotify.from_config(
+            self.config, app.ctx.SERVER_URL, db_conn, sessions
         )
 
-        ctx = Context(app=self, db=db_conn, spotify=spotify)
+        ctx = Context(app=self, db=db_conn, spotify=spotify, sessions=sessions)
 
         self.ctx = ctx
         app.ext.dependency(ctx, name="ctx")
 
+        self.runner = TaskRunner.from_config(ctx, self.config)
+
+        if self.config.getboolean("jobs", "enabled", fallback=False):
+            self.queue = JobQueue.from_config(db_conn.pool, self.config)
+
+        await db_conn.refresh_served_users()
+
+        # the events of this month need their partition
+        await self.events_task()
+
         ## Tasks ##
-        aiocron.crontab("*/5 * * * * 15", func=self.daily_smash_task)
-        aiocron.crontab("0,30 * * * *", func=self.public_liked_task)
-        aiocron.crontab("5 * * * *", func=self.live_weather_task)
-        aiocron.crontab("45 * * * *", func=self.liked_archive_task)
+        aiocron.crontab("*/10 * * * *", func=db_conn.refresh_served_users)
+        aiocron.crontab("30 3 * * *", func=self.events_task)
+        aiocron.crontab("* * * * * 15", func=self.daily_smash_task)
+        aiocron.crontab("* * * * *", func=self.public_liked_task)
+        aiocron.crontab("* * * * *", func=self.live_weather_task)
+        aiocron.crontab("* * * * *", func=self.liked_archive_task)
 
     async def close_hook(self, app: Sanic):
+        logging.info("Closing HTTP sessions")
+        await self.ctx.sessions.close()
+
         logging.info("Closing db connection")
         db_conn: Database = app.ctx.db
-        await db_conn.pool.close()
+        await db_conn.close()
 
     def register_listeners(self):
         self.app.register_listener(self.setup_hook, "before_server_start")
@@ -232,10 +276,23 @@ WHERE
 
         # Misc
         from .routes.misc import route_hello, route_health, route_status
+        from .routes.misc import route_spotify_limiter, route_cache_stats
+        from .routes.misc import route_metrics
 
         self.app.add_route(route_hello, "/", methods=["GET"])
         self.app.add_route(route_health, "/health", methods=["GET"])
         self.app.add_route(route_status, "/status", methods=["GET"])
+        self.app.add_route(route_spotify_limiter, "/spotify_limiter", methods=["GET"])
+        self.app.add_route(route_cache_stats, "/cache_stats", methods=["GET"])
+        self.app.add_route(route_metrics, "/metrics", methods=["GET"])
+
+        # Background runs
+        from .routes.runs import route_run, route_run_events
+
+        self.app.add_route(route_run, "/runs/<run_id:str>", methods=["GET"])
+        self.app.add_route(
+            route_run_events, "/runs/<run_id:str>/events", methods=["GET"]
+        )
 
         # Features
         from .routes.features import route_generate_playlist
@@ -1,10 +1,184 @@
 import json
+import logging
+import re
 import typing
+import uuid
+from datetime import date, datetime, timedelta, timezone
 
 import asyncpg
 
-from server.models.user import User
+from server.models.user import User, USER_FIELDS
 from server.models.context import Context
+from server.utils.cache import LRUCache
+from server.utils.metrics import DB_POOL_CONNECTIONS, DB_QUERY_SECONDS, timed_methods
+from server.utils.tasks import PHASE_SQL
+from server.utils.timing import timed_db_methods
+from server.utils.writebuffer import WriteBuffer
+
+# the playlist column of each feature, a user with the feature enabled but no playlist is skipped
+FEATURE_PLAYLISTS = {
+    "daily-smash": "ds_playlist",
+    "public-liked": "pl_playlist",
+    "live-weather": "lw_playlist",
+    "liked-archive": "la_playlist",
+}
+
+# the columns the feature tasks need, so sweeps don't hydrate whole rows (tokens, 20+ feature columns...)
+BASE_COLUMNS = (
+    "id",
+    "spotify_id",
+    "username",
+    "timezone",
+    "access_token",
+    "refresh_token",
+    "expires_at",
+)
+
+FEATURE_COLUMNS = {
+    "daily-smash": BASE_COLUMNS
+    + ("ds_playlist", "ds_songs_count", "ds_update_at", "ds_local_at"),
+    "public-liked": BASE_COLUMNS + ("pl_playlist",),
+    "live-weather": BASE_COLUMNS + ("lw_playlist", "lw_lat", "lw_lon", "lw_scale"),
+    "liked-archive": BASE_COLUMNS + ("la_playlist",),
+}
+
+ALL_COLUMNS = ", ".join(USER_FIELDS)
+
+# the counters of user_stats, a user with any of them above 0 was served
+STAT_KEYS = (
+    "generated_playlists",
+    "daily_smashes",
+    "filtered_playlists",
+    "archived_songs",
+    "weather_changes",
+)
+
+SERVED_USERS_QUERY = f"""
+  SELECT COUNT(*) FROM user_stats
+  WHERE {" OR ".join(f"{k} > 0" for k in STAT_KEYS)}
+  """
+
+
+def newly_served(row, key: str, add_value: int) -> bool:
+    """Whether adding `add_value` to the `key` stat made the user served (row is after the update)."""
+    if not any((row[k] or 0) > 0 for k in STAT_KEYS):
+        return False
+
+    # the other stats didn't change
+    return (row[key] or 0) - add_value <= 0 and not any(
+        (row[k] or 0) > 0 for k in STAT_KEYS if k != key
+    )
+
+
+# the monthly partitions of the events table (see migration 0005)
+EVENTS_PARTITION_RE = re.compile(r"^events_(\d{4})_(\d{2})$")
+
+# only one process maintains the events partitions at a time
+EVENTS_MAINTENANCE_LOCK = 0x6D757A6566  # next to setupdb.MIGRATIONS_LOCK
+
+EVENTS_PARTITIONS_QUERY = """
+  SELECT c.relname FROM pg_inherits i
+  JOIN pg_class c ON c.oid = i.inhrelid
+  WHERE i.inhparent = 'events'::regclass
+  """
+
+# the per-day aggregates of a partition, replaced if it's rolled up again
+EVENTS_ROLLUP_QUERY = """
+  INSERT INTO events_daily (day, name, events, successes, users)
+  SELECT
+    (created_at AT TIME ZONE 'UTC')::date,
+    name,
+    COUNT(*),
+    COUNT(*) FILTER (WHERE success),
+    COUNT(DISTINCT user_id)
+  FROM {partition}
+  GROUP BY 1, 2
+  ON CONFLICT (day, name) DO UPDATE SET
+    events = EXCLUDED.events,
+    successes = EXCLUDED.successes,
+    users = EXCLUDED.users
+  """
+
+
+def add_months(month: date, months: int) -> date:
+    """The first day of the month `months` after `month`."""
+    years, month_index = divmod(month.month - 1 + months, 12)
+    return date(month.year + years, month_index + 1, 1)
+
+
+# name -> (query, sample args) of the queries that must never fall back to a seq scan,
+# checked by `python -m server.setupdb --check`
+HOT_QUERIES: dict[str, tuple[str, tuple]] = {}
+
+
+def hot_query(name: str, query: str, *sample_args) -> str:
+    """Register a hot query and return it."""
+    HOT_QUERIES[name] = (query, sample_args)
+    return query
+
+
+GET_USER_QUERIES = {
+    by: hot_query(
+        f"get_user by {by}", f"SELECT {ALL_COLUMNS} FROM users WHERE {by} = $1", sample
+    )
+    for by, sample in (("id", uuid.UUID(int=0)), ("spotify_id", ""), ("token", ""))
+}
+
+PHASE_USERS_QUERIES = {
+    feature: hot_query(
+        f"get_phase_users {feature}",
+        f"""
+      SELECT {", ".join(FEATURE_COLUMNS[feature])} FROM users
+      WHERE
+        enabled_features @> ARRAY[$1]
+        AND {playlist_column} IS NOT NULL
+        AND {PHASE_SQL.format(period="$2")} = ANY($3::int[])
+      """,
+        feature,
+        60,
+        [0],
+    )
+    for feature, playlist_column in FEATURE_PLAYLISTS.items()
+}
+
+# claims the due users by moving their next run a lease ahead,
+# so a tick never picks a smash that is still running (or queued)
+CLAIM_DUE_DAILY_SMASH_QUERY = hot_query(
+    "claim_due_daily_smash_users",
+    f"""
+      UPDATE users SET ds_next_run_at = now() + $1::interval
+      WHERE id IN (
+        SELECT id FROM users
+        WHERE
+          ds_next_run_at <= now()
+          AND enabled_features @> ARRAY['daily-smash']
+          AND ds_playlist IS NOT NULL
+          AND ds_songs_count > 0
+        FOR UPDATE SKIP LOCKED
+      )
+      RETURNING {", ".join(FEATURE_COLUMNS["daily-smash"])}
+      """,
+    timedelta(minutes=30),
+)
+
+REPLACE_ACCESS_TOKEN_QUERY = hot_query(
+    "replace_access_token",
+    "UPDATE users SET access_token = $1 WHERE access_token = $2 RETURNING id",
+    "",
+    "",
+)
+
+LIKED_HEAD_QUERY = hot_query(
+    "get_liked_head",
+    """
+      SELECT track_id, added_at FROM user_liked_tracks
+      WHERE user_id = $1
+      ORDER BY added_at DESC NULLS LAST
+      LIMIT $2
+      """,
+    uuid.UUID(int=0),
+    1,
+)
 
 
 def user(func):
@@ -18,7 +192,7 @@ def user(func):
             user_id = user.user.id
         elif isinstance(user, User):
             user_id = user.id
-        elif isinstance(user, str):
+        elif isinstance(user, (str, uuid.UUID)):
             user_id = user
         else:
             raise ValueError("Invalid user type")
@@ -28,20 +202,182 @@ def user(func):
     return wrapper
 
 
+@timed_db_methods
+@timed_methods(DB_QUERY_SECONDS)
 class Database:
-    def __init__(self, pool: asyncpg.Pool):
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        users_cache_size: int = 10_000,
+        users_cache_ttl: float = 60,
+    ):
         self.pool = pool
 
+        # token -> user, for the authenticated requests (see get_authorized_user).
+        # invalidated by the methods below that change a user,
+        # the ttl bounds how stale a user changed by another process can be.
+        self.users_by_token = LRUCache(users_cache_size, ttl=users_cache_ttl)
+
+        # user id -> token, to invalidate users by id
+        self._user_tokens = LRUCache(users_cache_size, ttl=users_cache_ttl)
+
+        # the number of users that were served, kept up to date by the stats updates
+        # and refreshed periodically (other processes update it too)
+        self.served_users: int | None = None
+
+        # batches the events (created by connect)
+        self.buffer: WriteBuffer | None = None
+
+    @classmethod
+    async def connect(cls, config) -> "Database":
+        """Create the connection pool from the [database] config section."""
+        pool = await asyncpg.create_pool(
+            user=config.get("database", "username"),
+            password=config.get("database", "password"),
+            database=config.get("database", "database"),
+        )
+        DB_POOL_CONNECTIONS.labels("open").set_function(pool.get_size)
+        DB_POOL_CONNECTIONS.labels("idle").set_function(pool.get_idle_size)
+        DB_POOL_CONNECTIONS.labels("max").set_function(pool.get_max_size)
+
+        db = cls(
+            pool,
+            users_cache_size=config.getint("cache", "users_size", fallback=10_000),
+            users_cache_ttl=config.getfloat("cache", "users_ttl", fallback=60),
+        )
+
+        if config.getboolean("write_buffer", "enabled", fallback=True):
+            db.buffer = WriteBuffer.from_config(config, db._copy_events)
+            db.buffer.start()
+
+        return db
+
+    async def close(self):
+        """Write what's left in the write buffer and close the pool."""
+        if self.buffer is not None:
+            await self.buffer.close()
+
+        await self.pool.close()
+
+    def invalidate_users(self, *user_ids):
+        """Drop the users from the users cache (after they were changed)."""
+        for user_id in user_ids:
+            if (token := self._user_tokens.pop(str(user_id))) is not None:
+                self.users_by_token.pop(token)
+
     ## USER QUERIES ##
 
     async def get_user(self, value: str, by: str = "token") -> typing.Optional[User]:
         """Return the user object from the database given the "by"."""
         assert by in ("id", "spotify_id", "token"), "Invalid 'by' value"
 
-        raw_user = await self.pool.fetchrow(
-            f"SELECT * FROM users WHERE {by} = $1", value
+        raw_user = await self.pool.fetchrow(GET_USER_QUERIES[by], value)
+        return User.from_record(raw_user) if raw_user else None
+
+    async def get_authorized_user(self, token: str) -> typing.Optional[User]:
+        """
+        Return the user of an authenticated request, from the users cache if possible.
+        The returned user is a copy, so it can be changed freely.
+        """
+
+        if (user := self.users_by_token.get(token)) is None:
+            if (user := await self.get_user(token)) is None:
+                return None
+
+            self.users_by_token.set(token, user)
+            self._user_tokens.set(str(user.id), token)
+
+        return user.copy()
+
+    async def get_users(self, user_ids: list, feature: str) -> dict[typing.Any, User]:
+        """
+        Return the users with the given ids (with the feature's columns), by id.
+        Missing users are left out.
+        """
+        raw_users = await self.pool.fetch(
+            f"SELECT {', '.join(FEATURE_COLUMNS[feature])} FROM users WHERE id = ANY($1::uuid[])",
+            user_ids,
+        )
+        return {u["id"]: User.from_record(u) for u in raw_users}
+
+    async def get_phase_users(
+        self, feature: str, period: int, phases: list[int]
+    ) -> list[User]:
+        """
+        Return the users with the feature enabled
+        whose phase offset inside the `period` is one of `phases`.
+        Only the feature's columns are loaded.
+        """
+        raw_users = await self.pool.fetch(
+            PHASE_USERS_QUERIES[feature], feature, period, phases
+        )
+        return [User.from_record(u) for u in raw_users]
+
+    async def claim_due_daily_smash_users(self, lease: timedelta) -> list[User]:
+        """
+        Return the users whose Daily Smash is due (or overdue), and push their next run
+        `lease` ahead, so they aren't picked again while it runs.
+        The smash then schedules the next run (see run_scheduled_daily_smash),
+        if it never does (crash...), the smash runs again when the lease is over.
+        Only the Daily Smash columns are loaded.
+        """
+        raw_users = await self.pool.fetch(CLAIM_DUE_DAILY_SMASH_QUERY, lease)
+        users = [User.from_record(u) for u in raw_users]
+        self.invalidate_users(*(u.id for u in users))
+        return users
+
+    async def replace_access_token(self, old_access_token: str, access_token: str):
+        """Replace a (refreshed) access token."""
+        rows = await self.pool.fetch(
+            REPLACE_ACCESS_TOKEN_QUERY, access_token, old_access_token
+        )
+        self.invalidate_users(*(r["id"] for r in rows))
+
+    @user
+    async def update_user(self, user_id: str, **fields):
+        """Update the given columns of the user."""
+        assert fields and all(f in USER_FIELDS for f in fields), "Invalid field"
+
+        columns = ", ".join(f"{f} = ${i}" for i, f in enumerate(fields, start=2))
+        await self.pool.execute(
+            f"UPDATE users SET {columns} WHERE id = $1", user_id, *fields.values()
+        )
+        self.invalidate_users(user_id)
+
+    async def set_timezone(self, user: User, timezone: str):
+        """
+        Update the user's timezone (and the user object),
+        and move a scheduled Daily Smash to its wall-clock time in the new timezone.
+        """
+
+        user.timezone = timezone
+        fields = dict(timezone=timezone)
+
+        if user.ds_next_run_at is not None:
+            fields["ds_next_run_at"] = user.ds_next_run_at = user.ds_next_run()
+
+        await self.update_user(user, **fields)
+
+    @user
+    async def set_ds_next_run(self, user_id: str, next_run_at: datetime | None):
+        """Schedule the next Daily Smash of the user (None to unschedule)."""
+        await self.update_user(user_id, ds_next_run_at=next_run_at)
+
+    @user
+    async def update_tokens(
+        self,
+        user_id: str,
+        access_token: str,
+        refresh_token: str,
+        expires_at: datetime,
+    ):
+        """Store the user's refreshed tokens."""
+        await self.update_user(
+            user_id,
+            access_token=access_token,
+            refresh_token=refresh_token,
+            expires_at=expires_at,
         )
-        return User(**raw_user) if raw_user else None
 
     async def add_user(self, user: User) -> None:
         """Add a user to the database."""
@@ -61,61 +397,164 @@ class Database:
             user.token,
         )
 
+    async def advance_tick(self, feature: str, minute: int) -> int | None:
+        """
+        Save `minute` as the last tick of the feature's periodic task
+        and return the previous one (None on the first tick).
+        A minute that isn't after the previous one isn't saved.
+        """
+
+        async with self.pool.acquire() as conn, conn.transaction():
+            last = await conn.fetchval(
+                "SELECT minute FROM task_ticks WHERE feature = $1 FOR UPDATE", feature
+            )
+
+            await conn.execute(
+                """
+      INSERT INTO task_ticks (feature, minute) VALUES ($1, $2)
+      ON CONFLICT (feature) DO UPDATE SET minute = GREATEST(task_ticks.minute, $2)
+      """,
+                feature,
+                minute,
+            )
+
+        return last
+
+    async def refresh_served_users(self) -> int:
+        """Count the served users again."""
+        self.served_users = await self.pool.fetchval(SERVED_USERS_QUERY)
+        return self.served_users
+
     @user
     async def update_stat(self, user_id: str, key: str, add_value: int):
-        """Update a stat."""
+        """Update a stat and return its new value."""
 
-        assert key in (
-            "generated_playlists",
-            "daily_smashes",
-            "filtered_playlists",
-            "archived_songs",
-            "weather_changes",
-        ), "Invalid key"
+        assert key in STAT_KEYS, "Invalid key"
 
-        return await self.pool.fetchval(
+        row = await self.pool.fetchrow(
             f"""
       INSERT INTO user_stats (user_id, {key}) VALUES ($1, $2)
       ON CONFLICT (user_id) DO UPDATE SET {key} = user_stats.{key} + $2
-      RETURNING {key}
+      RETURNING {", ".join(STAT_KEYS)}
       """,
             user_id,
             add_value,
         )
 
+        if newly_served(row, key, add_value) and self.served_users is not None:
+            self.served_users += 1
+
+        return row[key]
+
     @user
     async def log_event(
         self, user_id: str, name: str, success: bool, data: dict = None
     ):
-        """Log an event."""
-        return await self.pool.execute(
-            """
-      INSERT INTO events (name, user_id, success, data)
-      VALUES ($1, $2, $3, $4)
-      """,
+        """Log an event (in the background, if the write buffer is enabled)."""
+
+        record = (
             name,
             user_id,
             success,
             json.dumps(data or {}),
+            datetime.now(timezone.utc),
+        )
+
+        if self.buffer is None:
+            await self._copy_events([record])
+        else:
+            self.buffer.add_event(record)
+
+    async def _copy_events(self, records: list[tuple]):
+        """Write events with a binary COPY."""
+        await self.pool.copy_records_to_table(
+            "events",
+            records=records,
+            columns=("name", "user_id", "success", "data", "created_at"),
         )
 
+    async def maintain_events(
+        self, retention_months: int = 6, months_ahead: int = 2, archive: bool = False
+    ) -> list[str]:
+        """
+        Create the events partitions of the next `months_ahead` months,
+        and roll up the partitions older than `retention_months` into events_daily.
+        The rolled up partitions are dropped, or detached if `archive`
+        (they stay as standalone tables, to be dumped and dropped by hand).
+
+        Returns the rolled up partitions.
+        """
+
+        this_month = datetime.now(timezone.utc).date().replace(day=1)
+        cutoff = add_months(this_month, -retention_months)
+        rolled_up = []
+
+        async with self.pool.acquire() as conn:
+            if not await conn.fetchval(
+                "SELECT pg_try_advisory_lock($1)", EVENTS_MAINTENANCE_LOCK
+            ):
+                logging.info("Events maintenance is running in another process")
+                return rolled_up
+
+            try:
+                for months in range(months_ahead + 1):
+                    await conn.execute(
+                        "SELECT create_events_partition($1)",
+                        add_months(this_month, months),
+                    )
+
+                partitions = sorted(
+                    r["relname"] for r in await conn.fetch(EVENTS_PARTITIONS_QUERY)
+                )
+
+                for partition in partitions:
+                    match = EVENTS_PARTITION_RE.match(partition)
+
+                    if not match or date(int(match[1]), int(match[2]), 1) >= cutoff:
+                        continue
+
+                    async with conn.transaction():
+                        await conn.execute(
+                            EVENTS_ROLLUP_QUERY.format(partition=partition)
+                        )
+
+                        if archive:
+                            await conn.execute(
+                                f"ALTER TABLE events DETACH PARTITION {partition}"
+                            )
+                        else:
+                            await conn.execute(f"DROP TABLE {partition}")
+
+                    logging.info(
+                        f"Rolled up {partition} ({'detached' if archive else 'dropped'})"
+                    )
+                    rolled_up.append(partition)
+            finally:
+                await conn.execute(
+                    "SELECT pg_advisory_unlock($1)", EVENTS_MAINTENANCE_LOCK
+                )
+
+        return rolled_up
+
     @user
     async def enable_feature(self, user_id: str, feature: str):
         """Enable a feature."""
-        return await self.pool.execute(
+        await self.pool.execute(
             "UPDATE users SET enabled_features = array_append(enabled_features, $1) WHERE id = $2",
             feature,
             user_id,
         )
+        self.invalidate_users(user_id)
 
     @user
     async def disable_feature(self, user_id: str, feature: str):
         """Disable a feature."""
-        return await self.pool.execute(
+        await self.pool.execute(
             "UPDATE users SET enabled_features = array_remove(enabled_features, $1) WHERE id = $2",
             feature,
             user_id,
         )
+        self.invalidate_users(user_id)
 
     @user
     async def load_cache(self, user_id: str, key: str, default: str | type = None):
@@ -149,3 +588,108 @@ class Database:
             key,
             json.dumps(value),
         )
+
+    @user
+    async def get_liked_head(
+        self, user_id: str, limit: int
+    ) -> list[tuple[str, datetime]]:
+        """The newest (track id, added_at) of the user's saved liked songs."""
+        return [
+            tuple(r) for r in await self.pool.fetch(LIKED_HEAD_QUERY, user_id, limit)
+        ]
+
+    @user
+    async def count_liked_tracks(self, user_id: str, track_ids: list[str]) -> int:
+        """How many of the tracks are in the user's saved liked songs."""
+        return await self.pool.fetchval(
+            """
+      SELECT count(*) FROM user_liked_tracks
+      WHERE user_id = $1 AND track_id = ANY($2::text[])
+      """,
+            user_id,
+            track_ids,
+        )
+
+    @user
+    async def add_liked_tracks(
+        self, user_id: str, tracks: list[tuple[str, datetime]]
+    ) -> None:
+        """Save newly liked (track id, added_at), re-liked tracks get their new added_at."""
+        await self.pool.execute(
+            """
+      INSERT INTO user_liked_tracks (user_id, track_id, added_at)
+      SELECT $1, * FROM unnest($2::text[], $3::timestamptz[])
+      ON CONFLICT (user_id, track_id) DO UPDATE SET added_at = EXCLUDED.added_at
+      """,
+            user_id,
+            [track_id for track_id, _ in tracks],
+            [added_at for _, added_at in tracks],
+        )
+
+    @user
+    async def sync_liked_tracks(
+        self, user_id: str, tracks: list[tuple[str, datetime]], dry_run: bool = False
+    ) -> tuple[list[str], list[str]]:
+        """
+        Replace the user's saved liked songs with `tracks` (track id, added_at).
+
+        The tracks are staged in a temp table with a binary COPY and diffed in SQL,
+        so only the changed rows are written.
+        Returns the (added, removed) track ids.
+        With `dry_run`, the changes are rolled back (to get the diff before applying it).
+        """
+
+        async with self.pool.acquire() as conn:
+            transaction = conn.transaction()
+            await transaction.start()
+
+            try:
+                await conn.execute(
+                    """
+      CREATE TEMP TABLE liked_staging (track_id TEXT, added_at TIMESTAMPTZ)
+      ON COMMIT DROP
+      """
+                )
+                await conn.copy_records_to_table("liked_staging", records=tracks)
+
+                removed = await conn.fetch(
+                    """
+      DELETE FROM user_liked_tracks
+      WHERE user_id = $1 AND track_id IN (
+        SELECT track_id FROM user_liked_tracks WHERE user_id = $1
+        EXCEPT
+        SELECT track_id FROM liked_staging
+      )
+      RETURNING track_id
+      """,
+                    user_id,
+                )
+
+                # rows that are new or were re-liked (or had no added_at)
+                upserted = await conn.fetch(
+                    """
+      INSERT INTO user_liked_tracks (user_id, track_id, added_at)
+      SELECT DISTINCT ON (track_id) $1::uuid, track_id, added_at FROM (
+        SELECT track_id, added_at FROM liked_staging
+        EXCEPT
+        SELECT track_id, added_at FROM user_liked_tracks WHERE user_id = $1
+      ) changed
+      ORDER BY track_id, added_at DESC
+      ON CONFLICT (user_id, track_id) DO UPDATE SET added_at = EXCLUDED.added_at
+      RETURNING track_id, (xmax = 0) AS inserted
+      """,
+                    user_id,
+                )
+            except BaseException:
+                await transaction.rollback()
+                raise
+
+            if dry_run:
+                await transaction.rollback()
+            else:
+                await transaction.commit()
+
+        return (
+            [r["track_id"] for r in upserted if r["inserted"]],
+            [r["track_id"] for r in removed],
+        )
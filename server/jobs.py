@@ -0,0 +1,162 @@
+import typing
+
+import asyncpg
+
+from server.actions import (
+    run_scheduled_daily_smash,
+    run_public_liked,
+    run_live_weather,
+    run_liked_archive,
+)
+
+# the actions a job of each feature runs
+FEATURE_ACTIONS: dict[str, typing.Callable[..., typing.Awaitable]] = {
+    "daily-smash": run_scheduled_daily_smash,
+    "public-liked": run_public_liked,
+    "live-weather": run_live_weather,
+    "liked-archive": run_liked_archive,
+}
+
+
+class JobQueue:
+    """
+    Durable per (user, feature) job queue stored in the `jobs` table.
+
+    Workers claim jobs with `FOR UPDATE SKIP LOCKED`, so any number of
+    worker processes can drain the queue without running a job twice.
+    A claimed job is hidden for `visibility_timeout` seconds; if the worker
+    doesn't finish it by then (crashed, killed...) it is claimable again.
+    """
+
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        visibility_timeout: float = 600,
+        max_attempts: int = 3,
+        retry_delay: float = 60,
+    ):
+        self.pool = pool
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    @classmethod
+    def from_config(cls, pool: asyncpg.Pool, config) -> "JobQueue":
+        return cls(
+            pool,
+            visibility_timeout=config.getfloat(
+                "jobs", "visibility_timeout", fallback=600
+            ),
+            max_attempts=config.getint("jobs", "max_attempts", fallback=3),
+            retry_delay=config.getfloat("jobs", "retry_delay", fallback=60),
+        )
+
+    async def enqueue(self, feature: str, user_ids: list[str]) -> int:
+        """
+        Queue a job for every user.
+        Users that already have a pending/running job for the feature are skipped.
+        Returns the number of queued jobs.
+        """
+
+        assert feature in FEATURE_ACTIONS, f"Unknown feature {feature!r}"
+
+        if not user_ids:
+            return 0
+
+        rows = await self.pool.fetch(
+            """
+      INSERT INTO jobs (user_id, feature, max_attempts)
+      SELECT unnest($1::uuid[]), $2, $3
+      ON CONFLICT (user_id, feature) WHERE status IN ('pending', 'running') DO NOTHING
+      RETURNING id
+      """,
+            user_ids,
+            feature,
+            self.max_attempts,
+        )
+        return len(rows)
+
+    async def claim(self, worker_id: str, limit: int) -> list[asyncpg.Record]:
+        """
+        Claim up to `limit` due jobs for the worker.
+        Running jobs whose visibility timeout expired are claimed again.
+        """
+
+        return await self.pool.fetch(
+            """
+      UPDATE jobs SET
+        status = 'running',
+        attempts = attempts + 1,
+        locked_by = $1,
+        locked_until = now() + make_interval(secs => $2)
+      WHERE id IN (
+        SELECT id FROM jobs
+        WHERE
+          attempts < max_attempts
+          AND (
+            (status = 'pending' AND run_after <= now())
+            OR (status = 'running' AND locked_until < now())
+          )
+        ORDER BY run_after
+        LIMIT $3
+        FOR UPDATE SKIP LOCKED
+      )
+      RETURNING id, user_id, feature, attempts
+      """,
+            worker_id,
+            self.visibility_timeout,
+            limit,
+        )
+
+    async def complete(self, job_id: int, worker_id: str):
+        """Mark a claimed job as done."""
+        return await self.pool.execute(
+            """
+      UPDATE jobs SET status = 'done', finished_at = now(), locked_until = NULL
+      WHERE id = $1 AND locked_by = $2 AND status = 'running'
+      """,
+            job_id,
+            worker_id,
+        )
+
+    async def fail(self, job_id: int, worker_id: str, error: str):
+        """
+        Mark a claimed job as failed.
+        It's queued again after `retry_delay` (doubling per attempt)
+        until it runs out of attempts.
+        """
+        return await self.pool.execute(
+            """
+      UPDATE jobs SET
+        status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END,
+        finished_at = CASE WHEN attempts >= max_attempts THEN now() END,
+        run_after = now() + make_interval(secs => $3 * 2 ^ (attempts - 1)),
+        last_error = $4,
+        locked_until = NULL
+      WHERE id = $1 AND locked_by = $2 AND status = 'running'
+      """,
+            job_id,
+            worker_id,
+            self.retry_delay,
+            error,
+        )
+
+    async def reap(self, keep_days: int = 7):
+        """
+        Fail running jobs that timed out on their last attempt,
+        and purge finished jobs older than `keep_days`.
+        """
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+        UPDATE jobs SET status = 'failed', finished_at = now(), last_error = 'visibility timeout'
+        WHERE status = 'running' AND locked_until < now() AND attempts >= max_attempts
+        """
+            )
+            await conn.execute(
+                """
+        DELETE FROM jobs
+        WHERE status IN ('done', 'failed') AND finished_at < now() - make_interval(days => $1)
+        """,
+                keep_days,
+            )
@@ -0,0 +1,116 @@
+-- initial schema
+-- (IF NOT EXISTS because these tables existed before migrations were tracked)
+
+CREATE TABLE IF NOT EXISTS users (
+  id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+
+  spotify_id TEXT UNIQUE,
+  email TEXT,
+  username TEXT,
+  avatar TEXT,
+
+  role TEXT DEFAULT 'user',
+  access_token TEXT,
+  refresh_token TEXT,
+  expires_at TIMESTAMP,
+  token TEXT,
+
+  first_login_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  last_login_at TIMESTAMP,
+
+  enabled_features TEXT[] DEFAULT '{}',
+
+  timezone TEXT,
+
+  -- daily smash (ds)
+  ds_playlist TEXT,
+  ds_update_at TIME,  -- will always be in UTC
+  ds_local_at TIME,  -- the same time, in the user's timezone
+  ds_next_run_at TIMESTAMPTZ,
+  ds_songs_count INT,
+
+  -- public liked (pl)
+  pl_playlist TEXT,
+
+  -- live weather (lw)
+  lw_playlist TEXT,
+  lw_lat FLOAT,
+  lw_lon FLOAT,
+  lw_scale TEXT,
+
+  -- liked archive (la)
+  la_playlist TEXT
+);
+
+-- daily smash scheduling (for users tables created before it existed)
+ALTER TABLE users ADD COLUMN IF NOT EXISTS ds_local_at TIME;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS ds_next_run_at TIMESTAMPTZ;
+
+UPDATE users SET
+  ds_local_at = ((CURRENT_DATE + ds_update_at) AT TIME ZONE 'UTC' AT TIME ZONE timezone)::time
+WHERE ds_local_at IS NULL AND ds_update_at IS NOT NULL AND timezone IS NOT NULL;
+
+UPDATE users SET
+  ds_next_run_at = (CURRENT_DATE + ds_update_at) AT TIME ZONE 'UTC'
+    + CASE WHEN (CURRENT_DATE + ds_update_at) AT TIME ZONE 'UTC' <= now() THEN interval '1 day' ELSE interval '0' END
+WHERE ds_next_run_at IS NULL AND ds_update_at IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS users_ds_next_run_at ON users (ds_next_run_at);
+
+
+CREATE TABLE IF NOT EXISTS user_stats (
+  user_id uuid PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+
+  generated_playlists INT DEFAULT 0,
+  daily_smashes INT DEFAULT 0,
+  filtered_playlists INT DEFAULT 0,
+  archived_songs INT DEFAULT 0,
+  weather_changes INT DEFAULT 0
+);
+
+
+CREATE TABLE IF NOT EXISTS events (
+  id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  name TEXT,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+  user_id uuid REFERENCES users(id) ON DELETE CASCADE,
+
+  success BOOLEAN,
+  data JSONB DEFAULT '{}'::jsonb
+);
+
+
+CREATE TABLE IF NOT EXISTS user_cache (
+  user_id uuid PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+  key TEXT,
+  value JSONB,
+
+  UNIQUE (user_id, key)
+);
+
+
+CREATE TABLE IF NOT EXISTS jobs (
+  id BIGSERIAL PRIMARY KEY,
+  user_id uuid REFERENCES users(id) ON DELETE CASCADE,
+  feature TEXT NOT NULL,
+
+  status TEXT NOT NULL DEFAULT 'pending',  -- pending / running / done / failed
+  attempts INT NOT NULL DEFAULT 0,
+  max_attempts INT NOT NULL DEFAULT 3,
+  last_error TEXT,
+
+  run_after TIMESTAMPTZ NOT NULL DEFAULT now(),
+  locked_by TEXT,
+  locked_until TIMESTAMPTZ,  -- visibility timeout of a running job
+
+  created_at TIMESTAMPTZ DEFAULT now(),
+  finished_at TIMESTAMPTZ
+);
+
+-- at most one queued/running job per (user, feature)
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_user_feature
+  ON jobs (user_id, feature) WHERE status IN ('pending', 'running');
+
+CREATE INDEX IF NOT EXISTS jobs_claimable
+  ON jobs (run_after) WHERE status IN ('pending', 'running');
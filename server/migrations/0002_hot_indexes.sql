@@ -0,0 +1,13 @@
+-- indexes for the hot lookups
+
+-- @authorized: get_user(by="token") on every request
+CREATE UNIQUE INDEX IF NOT EXISTS users_token ON users (token);
+
+-- MyHTTP.refresh_token updates the user by its access token
+CREATE UNIQUE INDEX IF NOT EXISTS users_access_token ON users (access_token);
+
+-- feature tasks: enabled_features @> ARRAY['feature']
+CREATE INDEX IF NOT EXISTS users_enabled_features ON users USING GIN (enabled_features);
+
+-- a user's events, newest first
+CREATE INDEX IF NOT EXISTS events_user_id_created_at ON events (user_id, created_at);
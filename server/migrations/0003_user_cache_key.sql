@@ -0,0 +1,9 @@
+-- user_cache had its primary key on user_id alone, so a user could only have one cache key
+
+ALTER TABLE user_cache DROP CONSTRAINT IF EXISTS user_cache_pkey;
+ALTER TABLE user_cache DROP CONSTRAINT IF EXISTS user_cache_user_id_key_key;
+
+DELETE FROM user_cache WHERE key IS NULL;
+ALTER TABLE user_cache ALTER COLUMN key SET NOT NULL;
+
+ALTER TABLE user_cache ADD PRIMARY KEY (user_id, key);
@@ -0,0 +1,29 @@
+-- the liked songs of the liked archive, one row per track
+-- (instead of a json array of uris in user_cache)
+
+CREATE TABLE IF NOT EXISTS user_liked_tracks (
+  user_id uuid REFERENCES users(id) ON DELETE CASCADE,
+  track_id TEXT,  -- spotify track id, without the spotify:track: prefix
+  added_at TIMESTAMPTZ,
+
+  PRIMARY KEY (user_id, track_id)
+);
+
+-- the newest liked songs of a user (the head of the liked songs sync)
+CREATE INDEX IF NOT EXISTS user_liked_tracks_user_id_added_at
+  ON user_liked_tracks (user_id, added_at);
+
+-- move the saved liked songs: a plain array of uris, or the sync state {"total", "tracks": [[uri, added_at]]}
+INSERT INTO user_liked_tracks (user_id, track_id, added_at)
+SELECT user_id, split_part(uri, ':', 3), NULL
+FROM user_cache, jsonb_array_elements_text(value) AS uri
+WHERE key = 'liked_songs' AND jsonb_typeof(value) = 'array'
+ON CONFLICT DO NOTHING;
+
+INSERT INTO user_liked_tracks (user_id, track_id, added_at)
+SELECT user_id, split_part(track->>0, ':', 3), (track->>1)::timestamptz
+FROM user_cache, jsonb_array_elements(value->'tracks') AS track
+WHERE key = 'liked_songs' AND jsonb_typeof(value) = 'object'
+ON CONFLICT DO NOTHING;
+
+DELETE FROM user_cache WHERE key = 'liked_songs';
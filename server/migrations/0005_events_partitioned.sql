@@ -0,0 +1,87 @@
+-- events partitioned by month (events_YYYY_MM), so old months can be
+-- rolled up into events_daily and dropped without vacuuming the whole table
+-- (see Database.maintain_events)
+
+ALTER TABLE events RENAME TO events_legacy;
+ALTER TABLE events_legacy RENAME CONSTRAINT events_pkey TO events_legacy_pkey;
+ALTER INDEX IF EXISTS events_user_id_created_at RENAME TO events_legacy_user_id_created_at;
+
+CREATE TABLE events (
+  id uuid DEFAULT gen_random_uuid(),
+  name TEXT,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+
+  user_id uuid REFERENCES users(id) ON DELETE CASCADE,
+
+  success BOOLEAN,
+  data JSONB DEFAULT '{}'::jsonb,
+
+  PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- a user's events, newest first
+CREATE INDEX IF NOT EXISTS events_user_id_created_at ON events (user_id, created_at);
+
+-- create the partition of the month of `p_month` (UTC months), returns its name
+CREATE OR REPLACE FUNCTION create_events_partition(p_month DATE) RETURNS TEXT AS $$
+DECLARE
+  from_date DATE := date_trunc('month', p_month);
+  partition_name TEXT := 'events_' || to_char(from_date, 'YYYY_MM');
+BEGIN
+  EXECUTE format(
+    'CREATE TABLE IF NOT EXISTS %I PARTITION OF events FOR VALUES FROM (%L) TO (%L)',
+    partition_name,
+    from_date::timestamp AT TIME ZONE 'UTC',
+    (from_date + interval '1 month')::timestamp AT TIME ZONE 'UTC'
+  );
+
+  RETURN partition_name;
+END
+$$ LANGUAGE plpgsql;
+
+-- per-day aggregates of the events, kept after the raw partitions are dropped
+CREATE TABLE IF NOT EXISTS events_daily (
+  day DATE,
+  name TEXT,
+
+  events INT NOT NULL,
+  successes INT NOT NULL,
+  users INT NOT NULL,
+
+  PRIMARY KEY (day, name)
+);
+
+-- partitions for the existing events, up to next month
+-- (from a month earlier, the legacy times are local and the partitions are UTC months)
+SELECT create_events_partition(m::date)
+FROM generate_series(
+  date_trunc('month', COALESCE((SELECT MIN(created_at) FROM events_legacy), now()))
+    - interval '1 month',
+  date_trunc('month', now()) + interval '1 month',
+  interval '1 month'
+) AS m;
+
+-- the legacy created_at was the server's local time
+-- liked_archive events keep the track ids of `added` instead of the uris
+INSERT INTO events (id, name, created_at, user_id, success, data)
+SELECT
+  id,
+  name,
+  COALESCE(created_at, now()),
+  user_id,
+  success,
+  CASE
+    WHEN name = 'liked_archive' AND jsonb_typeof(data->'request'->'added') = 'array'
+    THEN jsonb_set(
+      data,
+      '{request,added}',
+      (
+        SELECT COALESCE(jsonb_agg(split_part(uri, ':', 3)), '[]'::jsonb)
+        FROM jsonb_array_elements_text(data->'request'->'added') AS uri
+      )
+    )
+    ELSE data
+  END
+FROM events_legacy;
+
+DROP TABLE events_legacy;
@@ -0,0 +1,7 @@
+-- the last minute (since epoch, UTC) each periodic feature task ran for,
+-- so the ticks missed while the app was down are caught up on restart
+
+CREATE TABLE IF NOT EXISTS task_ticks (
+  feature TEXT PRIMARY KEY,
+  minute INT NOT NULL
+);
@@ -7,6 +7,8 @@ if typing.TYPE_CHECKING:
     from server.models.user import User
     from server.database import Database
     from server.utils.spotify import Spotify, MySpotifyClient
+    from server.utils.sessions import Sessions
+    from server.utils.progress import Run
     from sanic.response import JSONResponse
 
 
@@ -17,10 +19,13 @@ class Context:
     Note, this isn't relevant to sanic app.ctx or request.ctx.
     """
 
-    def __init__(self, app: "Muzee", db: "Database", spotify: "Spotify"):
+    def __init__(
+        self, app: "Muzee", db: "Database", spotify: "Spotify", sessions: "Sessions"
+    ):
         self.app = app
         self.db = db
         self.spotify = spotify
+        self.sessions = sessions
 
         # this might be injected by the @authorized decorator
         self.user: User | None = None
@@ -28,6 +33,14 @@ class Context:
         # this might be injected by the @use_spotify decorator
         self.sc: MySpotifyClient | None = None
 
+        # this might be injected by the @background decorator
+        self.progress: Run | None = None
+
+    def report(self, **counts: int):
+        """Report progress to the background run, if any."""
+        if self.progress is not None:
+            self.progress.report(**counts)
+
     async def playlist_response(self, playlist_id: str) -> "JSONResponse":
         return json(
             {
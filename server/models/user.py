@@ -1,5 +1,6 @@
-from dataclasses import dataclass
-from datetime import datetime
+import copy
+from dataclasses import dataclass, fields
+from datetime import datetime, time, timedelta
 
 import pytz
 import enum
@@ -13,8 +14,15 @@ class RoleEnum(str, enum.Enum):  # use enum.StrEnum in Python 3.11+
         return self.value
 
 
-@dataclass
+@dataclass(slots=True, repr=False)
 class User:
+    """
+    A row of the users table.
+
+    Users loaded with a column projection (see `User.from_record`) only have
+    the projected fields set (see `FEATURE_COLUMNS` in the database module).
+    """
+
     spotify_id: str
     email: str
     username: str
@@ -38,7 +46,9 @@ class User:
 
     # features related
     ds_playlist: str = None
-    ds_update_at: datetime = None
+    ds_update_at: time = None  # in UTC
+    ds_local_at: time = None  # in the user's timezone
+    ds_next_run_at: datetime = None
     ds_songs_count: int = None
     pl_playlist: str = None
     la_playlist: str = None
@@ -47,11 +57,79 @@ class User:
     lw_lon: float = None
     lw_scale: str = None
 
+    @classmethod
+    def from_record(cls, record) -> "User":
+        """Create a user from a (possibly partial) users row, leaving the missing fields unloaded."""
+        user = cls.__new__(cls)
+
+        for key, value in record.items():
+            setattr(user, key, value)
+
+        return user
+
+    def is_loaded(self, field: str) -> bool:
+        return hasattr(self, field)
+
+    def copy(self) -> "User":
+        """A copy of the user that can be changed without affecting this one."""
+        user = copy.copy(self)
+
+        if self.is_loaded("enabled_features") and self.enabled_features is not None:
+            user.enabled_features = list(self.enabled_features)
+
+        return user
+
+    def __getattr__(self, name: str):
+        # only called for unset slots (and unknown attributes)
+        if name in USER_FIELDS:
+            raise AttributeError(
+                f"User.{name} was not loaded, add it to the feature's FEATURE_COLUMNS"
+            )
+
+        raise AttributeError(f"'User' object has no attribute {name!r}")
+
+    def __repr__(self):
+        loaded = ", ".join(
+            f"{f}={getattr(self, f)!r}"
+            for f in USER_FIELDS
+            if f not in ("access_token", "refresh_token", "token") and self.is_loaded(f)
+        )
+        return f"User({loaded})"
+
     @property
     def ds_update_at_minutes(self) -> int | None:
         if self.ds_update_at is not None:
             return self.ds_update_at.minute + self.ds_update_at.hour * 60
 
+    def ds_next_run(self, after: datetime = None) -> datetime | None:
+        """
+        The next time (in UTC) the user's Daily Smash should run, after `after` (default: now).
+        Computed in the user's timezone, so the smash stays at the same wall-clock time across DST changes.
+        None if the user has no Daily Smash time.
+        """
+
+        after = after or datetime.now(pytz.UTC)
+
+        if self.ds_local_at is None or self.timezone is None:
+            # no wall-clock time to follow, stick to the UTC time
+            tz, at = pytz.UTC, self.ds_update_at
+        else:
+            tz, at = self.tz, self.ds_local_at
+
+        if at is None:
+            return None
+
+        day = after.astimezone(tz).date()
+
+        while True:
+            # normalize() moves times that fall in a DST gap forward
+            run_at = tz.normalize(tz.localize(datetime.combine(day, at)))
+
+            if run_at > after:
+                return run_at.astimezone(pytz.UTC)
+
+            day += timedelta(days=1)
+
     @property
     def tz(self) -> pytz.BaseTzInfo:
         """Convert user's timezone string to a pytz timezone object."""
@@ -61,3 +139,6 @@ class User:
     def now(self) -> datetime:
         """Get the current time in the user's timezone."""
         return datetime.now(self.tz)
+
+
+USER_FIELDS: tuple[str, ...] = tuple(f.name for f in fields(User))
@@ -1,4 +1,5 @@
 import re
+import typing
 
 from datetime import datetime
 import pydantic
@@ -10,7 +11,9 @@ from server.models.context import Context
 from server import actions
 
 from server.utils.decos import use_spotify
+from server.utils.langfilter import LanguageMatcher, SCRIPTS, TRACK_FIELDS
 from .helpers.auth import authorized
+from .helpers.runs import background
 
 playlist_regex = (
     r"(?:https:\/\/open\.spotify\.com\/playlist\/)?([a-zA-Z0-9]{22})(?:\?.+)?"
@@ -30,7 +33,16 @@ class ToggleDailySmashData(pydantic.BaseModel):
 
 class LanguageFilterData(pydantic.BaseModel):
     playlist: str = pydantic.Field(pattern=playlist_regex, min_length=22)
-    keep_chars: pydantic.constr(min_length=1, max_length=150)
+    keep_chars: pydantic.constr(max_length=150) = ""
+    scripts: list[typing.Literal[tuple(SCRIPTS)]] = []
+    match_in: list[typing.Literal[TRACK_FIELDS]] = pydantic.Field(
+        default=["title"], min_length=1
+    )
+
+    @pydantic.model_validator(mode="after")
+    def check_filter(self):
+        assert self.keep_chars or self.scripts, "Provide keep_chars or scripts"
+        return self
 
     @pydantic.computed_field
     @property
@@ -61,6 +73,7 @@ class ToggleLikedArchiveData(pydantic.BaseModel):
 
 @authorized()
 @validate(json=GeneratePlaylistData)
+@background("generate_playlist")
 async def route_generate_playlist(
     request: Request, ctx: Context, body: GeneratePlaylistData
 ):
@@ -77,6 +90,7 @@ async def route_generate_playlist(
 
 @authorized()
 @validate(json=ToggleDailySmashData)
+@background("toggle_daily_smash")
 @use_spotify
 async def route_toggle_daily_smash(
     request: Request, ctx: Context, body: ToggleDailySmashData
@@ -96,32 +110,32 @@ async def route_toggle_daily_smash(
     if not body.enabled:
         # remove the feature (remove daily-smash from the array of features)
         await ctx.db.disable_feature(ctx.user, "daily-smash")
+        await ctx.db.set_ds_next_run(ctx.user, None)
         return json({"status": "ok"})
 
     # enable
     await ctx.db.enable_feature(ctx.user, "daily-smash")
 
-    # ds_update_at will always be in UTC
+    # ds_update_at will always be in UTC, ds_local_at is the time the user picked
     hours, minutes = divmod(body.update_at, 60)
     clients_time = datetime.now(ctx.user.tz).replace(
         hour=hours, minute=minutes, second=0, microsecond=0
     )
     utc_time = clients_time.astimezone(pytz.utc).time()
 
+    ctx.user.ds_update_at = utc_time
+    ctx.user.ds_local_at = clients_time.time()
+
     # has a daily smash already?
     if ctx.user.ds_playlist:
-        # need to update anything?
-        if (
-            ctx.user.ds_songs_count != body.songs_count
-            or ctx.user.ds_update_at != utc_time
-        ):
-            # need to update the playlist
-            await ctx.db.pool.execute(
-                "UPDATE users SET ds_songs_count = $1, ds_update_at = $2 WHERE id = $3",
-                body.songs_count,
-                utc_time,
-                ctx.user.id,
-            )
+        # update the settings and reschedule
+        await ctx.db.update_user(
+            ctx.user,
+            ds_songs_count=body.songs_count,
+            ds_update_at=utc_time,
+            ds_local_at=ctx.user.ds_local_at,
+            ds_next_run_at=ctx.user.ds_next_run(),
+        )
 
         return json(
             {
@@ -138,12 +152,13 @@ async def route_toggle_daily_smash(
         playlist = await actions.run_daily_smash(ctx=ctx, create=True)
         ctx.user.ds_playlist = playlist
 
-        await ctx.db.pool.execute(
-            "UPDATE users SET ds_playlist = $1, ds_songs_count = $2, ds_update_at = $3 WHERE id = $4",
-            playlist,
-            body.songs_count,
-            utc_time,
-            ctx.user.id,
+        await ctx.db.update_user(
+            ctx.user,
+            ds_playlist=playlist,
+            ds_songs_count=body.songs_count,
+            ds_update_at=utc_time,
+            ds_local_at=ctx.user.ds_local_at,
+            ds_next_run_at=ctx.user.ds_next_run(),
         )
 
         return json(
@@ -196,6 +211,7 @@ async def route_feature_details(request: Request, ctx: Context):
 
 @authorized()
 @validate(json=LanguageFilterData)
+@background("language_filter")
 @use_spotify
 async def route_language_filter(
     request: Request, ctx: Context, body: LanguageFilterData
@@ -207,20 +223,21 @@ async def route_language_filter(
     # get the spotify client to generate the playlist
 
     # playlist name?
-    js = await ctx.sc.get(f"playlists/{body.playlist_id}", fields="name")
+    js = await ctx.sc.get(f"playlists/{body.playlist_id}", fields="name,snapshot_id")
     pname = js["name"]
 
     # get songs
-    tracks = await ctx.sc.get_all_playlist_tracks(
-        body.playlist_id, fields="items(type,track(is_local,uri,name))"
+    tracks = await ctx.sc.get_playlist_items(
+        body.playlist_id, view="texts", snapshot_id=js["snapshot_id"]
     )
-    keep_tracks = set()
 
-    for track in tracks:
-        name = track["track"]["name"]
+    matcher = LanguageMatcher(scripts=body.scripts, chars=body.keep_chars)
+    fields = [TRACK_FIELDS.index(f) + 1 for f in body.match_in]
 
-        if any(c in body.keep_chars for c in name):
-            keep_tracks.add(track["track"]["uri"])
+    keep_tracks = {
+        track[0] for track in tracks if matcher.match(*(track[i] for i in fields))
+    }
+    ctx.report(tracks_matched=len(keep_tracks))
 
     # create a new playlist
     filtered_pname = f"Filtered {pname}"
@@ -230,7 +247,7 @@ async def route_language_filter(
         description=f"🪄 Filtered by Muzee @ {ctx.user.now().strftime('%H:%M %d/%m/%Y')}.",
     )
 
-    await ctx.sc.add_tracks_to_playlist(playlist.id, list(keep_tracks))
+    await ctx.sc.writer.add(playlist.id, list(keep_tracks))
 
     return json(
         {
@@ -245,6 +262,7 @@ async def route_language_filter(
 
 @authorized()
 @validate(json=TogglePublicLikedData)
+@background("toggle_public_liked")
 @use_spotify
 async def route_toggle_public_liked(
     request: Request, ctx: Context, body: TogglePublicLikedData
@@ -283,9 +301,7 @@ async def route_toggle_public_liked(
         playlist = await actions.run_public_liked(ctx=ctx, create=True)
         ctx.user.pl_playlist = playlist
 
-        await ctx.db.pool.execute(
-            "UPDATE users SET pl_playlist = $1 WHERE id = $2", playlist, ctx.user.id
-        )
+        await ctx.db.update_user(ctx.user, pl_playlist=playlist)
 
         return json(
             {
@@ -298,6 +314,7 @@ async def route_toggle_public_liked(
 
 @authorized()
 @validate(json=ToggleLiveWeatherData)
+@background("toggle_live_weather")
 @use_spotify
 async def route_toggle_live_weather(
     request: Request, ctx: Context, body: ToggleLiveWeatherData
@@ -324,13 +341,12 @@ async def route_toggle_live_weather(
             or ctx.user.lw_scale != body.scale
         )
     ):
-        await ctx.db.pool.execute(
-            "UPDATE users SET lw_playlist = $1, lw_lat = $2, lw_lon = $3, lw_scale = $4 WHERE id = $5",
-            body.playlist_id,
-            body.lat,
-            body.lon,
-            body.scale,
-            ctx.user.id,
+        await ctx.db.update_user(
+            ctx.user,
+            lw_playlist=body.playlist_id,
+            lw_lat=body.lat,
+            lw_lon=body.lon,
+            lw_scale=body.scale,
         )
         ctx.user.lw_playlist = body.playlist_id
         ctx.user.lw_lat = body.lat
@@ -346,6 +362,7 @@ async def route_toggle_live_weather(
 
 @authorized()
 @validate(json=ToggleLikedArchiveData)
+@background("toggle_liked_archive")
 @use_spotify
 async def route_toggle_liked_archive(
     request: Request, ctx: Context, body: ToggleLikedArchiveData
@@ -360,15 +377,7 @@ async def route_toggle_liked_archive(
     if ctx.user.la_playlist is None:
         playlist_id = await actions.run_liked_archive(ctx=ctx, create=True)
 
-        await ctx.db.pool.execute(
-            """
-            UPDATE users
-            SET la_playlist = $1
-            WHERE id = $2
-            """,
-            playlist_id,
-            ctx.user.id,
-        )
+        await ctx.db.update_user(ctx.user, la_playlist=playlist_id)
         ctx.user.la_playlist = playlist_id
 
     return await ctx.playlist_response(ctx.user.la_playlist)
@@ -37,8 +37,8 @@ def authorized(force: bool = True):
                     )
                 return await func(request, *args, **kwargs)
 
-            # check if the token is in the database
-            user = await db.get_user(token)
+            # check if the token is in the database (or in the users cache)
+            user = await db.get_authorized_user(token)
 
             if not user:
                 if force:
@@ -52,10 +52,7 @@ def authorized(force: bool = True):
                         tz
                     )  # raises and exists the context manager if the timezone is invalid
 
-                    await db.pool.execute(
-                        "UPDATE users SET timezone = $1 WHERE id = $2", tz, user.id
-                    )
-                    user.timezone = tz
+                    await db.set_timezone(user, tz)
                     logging.info(f"Updated timezone for {user.username}: {tz}")
 
             # inject the user object as a parameter
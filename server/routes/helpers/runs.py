@@ -0,0 +1,49 @@
+import copy
+import json as json_lib
+from functools import wraps
+
+from sanic import Request, json
+
+from server.models.context import Context
+
+
+def background(name: str):
+    """
+    Let the client run the endpoint in the background with `?async=1`.
+
+    The endpoint then answers 202 with a run id right away, and its response body
+    becomes the run's result. The progress and the result are streamed by
+    /runs/<run_id>/events (see server.utils.progress).
+
+    Put it under @authorized and @validate, and above @use_spotify.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(request: Request, *args, **kwargs):
+            if request.args.get("async") not in ("1", "true"):
+                return await func(request, *args, **kwargs)
+
+            assert "ctx" in kwargs, "You must provide the ctx object in the kwargs"
+            ctx: Context = copy.copy(kwargs["ctx"])
+            kwargs["ctx"] = ctx
+
+            async def action(run):
+                ctx.progress = run
+                resp = await func(request, *args, **kwargs)
+                return json_lib.loads(resp.body)
+
+            run = ctx.app.runs.start(name, ctx.user.id, action)
+
+            return json(
+                {
+                    "status": "accepted",
+                    "run_id": run.id,
+                    "events": f"/runs/{run.id}/events",
+                },
+                status=202,
+            )
+
+        return wrapper
+
+    return decorator
@@ -1,6 +1,8 @@
 from sanic import Request, text, json, empty
 
 from server.models.context import Context
+from server.models.user import RoleEnum
+from server.utils.metrics import REGISTRY, CONTENT_TYPE
 from .helpers.auth import authorized
 
 
@@ -12,6 +14,20 @@ async def route_health(request: Request):
     return empty()
 
 
+async def route_metrics(request: Request, ctx: Context):
+    """
+    Get the metrics of this process, in the Prometheus text format.
+    Requires the `[metrics] token` as a bearer token, if it's set.
+    """
+
+    token = ctx.app.config.get("metrics", "token", fallback="")
+
+    if token and request.token != token:
+        return empty(status=401)
+
+    return text(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
 @authorized(force=False)
 async def route_status(request: Request, ctx: Context):
     """
@@ -19,16 +35,11 @@ async def route_status(request: Request, ctx: Context):
     and the status of the user (is logged, profile)
     """
 
-    served_users = await ctx.db.pool.fetchval(
-        """
-  SELECT COUNT(*) FROM user_stats WHERE
-    generated_playlists > 0 OR 
-    daily_smashes > 0 OR
-    filtered_playlists > 0 OR
-    archived_songs > 0 OR
-    weather_changes > 0
-  """
-    )
+    # kept in memory by the db (see Database.served_users)
+    served_users = ctx.db.served_users
+
+    if served_users is None:
+        served_users = await ctx.db.refresh_served_users()
 
     if ctx.user is None:
         return json(dict(served_users=served_users, status="online", is_logged=False))
@@ -46,3 +57,31 @@ async def route_status(request: Request, ctx: Context):
             enabled_features=ctx.user.enabled_features,
         )
     )
+
+
+@authorized()
+async def route_spotify_limiter(request: Request, ctx: Context):
+    """
+    Get the state of the app-wide Spotify rate limiter (admins only)
+    """
+
+    assert ctx.user.role == RoleEnum.admin, "Admins only."
+
+    return json(ctx.spotify.limiter.stats())
+
+
+@authorized()
+async def route_cache_stats(request: Request, ctx: Context):
+    """
+    Get the hits/misses of the in-process caches (admins only)
+    """
+
+    assert ctx.user.role == RoleEnum.admin, "Admins only."
+
+    return json(
+        dict(
+            users=ctx.db.users_by_token.stats(),
+            playlists=ctx.spotify.playlist_cache.stats(),
+            images=ctx.spotify.image_cache.stats(),
+        )
+    )
@@ -0,0 +1,36 @@
+import json as json_lib
+
+from sanic import Request, json
+
+from server.models.context import Context
+
+
+async def route_run(request: Request, ctx: Context, run_id: str):
+    """
+    Get the state of a background run (the run id is the capability, since
+    EventSource can't send the Authorization header)
+    """
+
+    if (run := ctx.app.runs.get(run_id)) is None:
+        return json({"error": "not_found", "msg": "No such run"}, status=404)
+
+    return json(run.to_dict())
+
+
+async def route_run_events(request: Request, ctx: Context, run_id: str):
+    """
+    Stream the progress and the result of a background run (Server-Sent Events)
+    """
+
+    if (run := ctx.app.runs.get(run_id)) is None:
+        return json({"error": "not_found", "msg": "No such run"}, status=404)
+
+    response = await request.respond(
+        content_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+    async for event, data in run.events():
+        await response.send(f"event: {event}\ndata: {json_lib.dumps(data)}\n\n")
+
+    await response.eof()
@@ -1,111 +1,143 @@
-# setup db based on the models
+# setup the db by applying the migrations in ./migrations
+#
+# usage (in /muzee):
+#   python -m server.setupdb           apply the pending migrations
+#   python -m server.setupdb --check   fail if a hot query falls back to a seq scan
 
+import argparse
 import asyncio
+import json
 import logging
 import configparser
+import os
+import re
+import sys
 
 import asyncpg
 import coloredlogs
 
+from server.database import HOT_QUERIES
+
 coloredlogs.install(level="INFO")
 
-tables = dict(
-    users="""
-  CREATE TABLE IF NOT EXISTS users (
-    id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
-    
-    spotify_id TEXT UNIQUE,
-    email TEXT,
-    username TEXT,
-    avatar TEXT,
-    
-    role TEXT DEFAULT 'user',
-    access_token TEXT,
-    refresh_token TEXT,
-    expires_at TIMESTAMP,
-    token TEXT,
-    
-    first_login_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    last_login_at TIMESTAMP,
-       
-    enabled_features TEXT[] DEFAULT '{}',
-    
-    timezone TEXT,
-    
-    -- daily smash (ds)
-    ds_playlist TEXT,    
-    ds_update_at TIME,  -- will always be in UTC
-    ds_songs_count INT,
-    
-    -- public liked (pl)
-    pl_playlist TEXT,
-    
-    -- live weather (lw)
-    lw_playlist TEXT,
-    lw_lat FLOAT,
-    lw_lon FLOAT,
-    lw_scale TEXT,
-    
-    -- liked archive (la)
-    la_playlist TEXT
-    
-  );
-  """,
-    user_stats="""
-  CREATE TABLE IF NOT EXISTS user_stats (
-    user_id uuid PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
-        
-    generated_playlists INT DEFAULT 0,
-    daily_smashes INT DEFAULT 0,
-    filtered_playlists INT DEFAULT 0,
-    archived_songs INT DEFAULT 0,
-    weather_changes INT DEFAULT 0
-  );
-  
-  """,
-    events="""
-  CREATE TABLE IF NOT EXISTS events (
-    id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
-    name TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    
-    user_id uuid REFERENCES users(id) ON DELETE CASCADE,
-    
-    success BOOLEAN,
-    data JSONB DEFAULT '{}'::jsonb
-  );
-  """,
-    user_cache="""
-    CREATE TABLE IF NOT EXISTS user_cache (
-        user_id uuid PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
-        key TEXT,
-        value JSONB,
-        
-        UNIQUE (user_id, key)
-    );
-    """,
-)
-
-
-async def setup_db(pool: asyncpg.Pool, redo: list | bool = None):
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# arbitrary key for pg_advisory_lock, so two processes never migrate at the same time
+MIGRATIONS_LOCK = 0x6D757A6565
+
+
+def load_migrations() -> list[tuple[int, str, str]]:
+    """Return the (version, name, sql) of the migrations, ordered by version."""
+    migrations = []
+
+    for filename in os.listdir(MIGRATIONS_DIR):
+        if not (match := re.match(r"^(\d+)_(\w+)\.sql$", filename)):
+            continue
+
+        with open(os.path.join(MIGRATIONS_DIR, filename)) as f:
+            migrations.append((int(match[1]), match[2], f.read()))
+
+    migrations.sort()
+
+    versions = [version for version, *_ in migrations]
+    assert len(versions) == len(set(versions)), "Duplicate migration versions"
+
+    return migrations
+
+
+async def migrate(pool: asyncpg.Pool) -> list[int]:
+    """
+    Apply the pending migrations, each one in its own transaction.
+    Migrations are forward-only; applied versions are tracked in schema_migrations.
+    Returns the applied versions.
+    """
+
+    applied_now = []
+
     async with pool.acquire() as conn:
-        for table in tables:
-            if redo:
-                if redo is not True and table not in redo:
+        await conn.execute(
+            """
+      CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMPTZ DEFAULT now()
+      );
+      """
+        )
+
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK)
+
+        try:
+            applied = {
+                r["version"]
+                for r in await conn.fetch("SELECT version FROM schema_migrations")
+            }
+
+            for version, name, sql in load_migrations():
+                if version in applied:
                     continue
 
-                logging.info(f"Dropping table {table}")
-                await conn.execute(f"DROP TABLE IF EXISTS {table} CASCADE;")
+                logging.info(f"Applying migration {version:04d}_{name}")
 
-                if table == "runs":
-                    logging.info("^ Resetting total_runs from muzee")
-                    await conn.execute("UPDATE muzee SET total_runs = 0")
+                async with conn.transaction():
+                    await conn.execute(sql)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                        version,
+                        name,
+                    )
 
-            logging.info(f"Creating table {table}")
-            await conn.execute(tables[table])
+                applied_now.append(version)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK)
 
+    if not applied_now:
+        logging.info("Database is up to date")
 
-async def main(*args, **kwargs):
+    return applied_now
+
+
+def _seq_scans(plan: dict) -> list[str]:
+    """Return the relations that are sequentially scanned in the plan."""
+    scans = []
+
+    if plan.get("Node Type") == "Seq Scan":
+        scans.append(plan.get("Relation Name"))
+
+    for subplan in plan.get("Plans", []):
+        scans += _seq_scans(subplan)
+
+    return scans
+
+
+async def check_query_plans(pool: asyncpg.Pool) -> bool:
+    """
+    EXPLAIN every hot query of the Database (with seq scans discouraged)
+    and report the ones that can't be served by an index.
+    Returns whether all the hot queries use an index.
+    """
+
+    ok = True
+
+    async with pool.acquire() as conn:
+        for name, (query, sample_args) in HOT_QUERIES.items():
+            async with conn.transaction():
+                # the planner still picks a seq scan if no index can serve the query
+                await conn.execute("SET LOCAL enable_seqscan = off")
+                plan = await conn.fetchval(
+                    f"EXPLAIN (FORMAT JSON) {query}", *sample_args
+                )
+
+            if scans := _seq_scans(json.loads(plan)[0]["Plan"]):
+                logging.error(f"{name}: seq scan on {', '.join(scans)}")
+                ok = False
+            else:
+                logging.info(f"{name}: ok")
+
+    return ok
+
+
+async def main(check: bool = False) -> bool:
     config = configparser.ConfigParser()
     config.read("config.ini")
 
@@ -115,9 +147,22 @@ async def main(*args, **kwargs):
         password=config.get("database", "password"),
         database=config.get("database", "database"),
     ) as pool:
-        logging.info("Setting up the database")
-        await setup_db(pool, *args, **kwargs)
+        if check:
+            logging.info("Checking the hot queries plans")
+            return await check_query_plans(pool)
+
+        logging.info("Migrating the database")
+        await migrate(pool)
+        return True
 
 
 if __name__ == "__main__":
-    asyncio.run(main(redo=["user_cache"]))
+    parser = argparse.ArgumentParser(description="Muzee database setup")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="fail if a hot query falls back to a seq scan",
+    )
+    args = parser.parse_args()
+
+    sys.exit(0 if asyncio.run(main(check=args.check)) else 1)
@@ -0,0 +1,100 @@
+import time
+import typing
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    In-memory LRU cache, optionally with a TTL.
+
+    The cache holds up to `maxsize` units, where every value weighs `sizeof(value)`
+    units (1 by default), so the cache can be capped by e.g. the number of tracks
+    instead of the number of entries.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float | None = None,
+        sizeof: typing.Callable[[typing.Any], int] | None = None,
+    ):
+        assert maxsize > 0, "maxsize must be positive"
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sizeof = sizeof or (lambda value: 1)
+
+        # key -> (value, size, expires_at)
+        self._data: OrderedDict[typing.Hashable, tuple] = OrderedDict()
+        self.size = 0
+
+        # stats
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _count=False) is not None
+
+    def get(self, key, default=None, _count: bool = True):
+        entry = self._data.get(key)
+
+        if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+            self.pop(key)
+            entry = None
+
+        if entry is None:
+            if _count:
+                self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+
+        if _count:
+            self.hits += 1
+
+        return entry[0]
+
+    def set(self, key, value, ttl: float | None = None):
+        """Set a value, `ttl` overrides the cache's ttl for this entry."""
+        self.pop(key)
+
+        size = self.sizeof(value)
+
+        # would never fit
+        if size > self.maxsize:
+            return
+
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (value, size, expires_at)
+        self.size += size
+
+        while self.size > self.maxsize:
+            _, (_, evicted_size, _) = self._data.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        if (entry := self._data.pop(key, None)) is None:
+            return default
+
+        self.size -= entry[1]
+        return entry[0]
+
+    def clear(self):
+        self._data.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return dict(
+            entries=len(self._data),
+            size=self.size,
+            maxsize=self.maxsize,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+        )
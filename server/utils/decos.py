@@ -17,6 +17,7 @@ def use_spotify(func):
         assert "ctx" in kwargs, "You must provide the ctx object in the kwargs"
         kwargs["ctx"] = copy.copy(kwargs["ctx"])
         kwargs["ctx"].sc = sc
+        sc.progress = kwargs["ctx"].progress
 
         try:
             return await func(*args, **kwargs)
@@ -0,0 +1,86 @@
+import re
+
+# named scripts -> their unicode blocks (codepoint ranges, inclusive)
+SCRIPTS: dict[str, tuple[tuple[int, int], ...]] = {
+    "latin": (
+        (0x0041, 0x005A),
+        (0x0061, 0x007A),
+        (0x00C0, 0x024F),  # latin-1 supplement letters, latin extended a/b
+        (0x1E00, 0x1EFF),  # latin extended additional
+    ),
+    "hebrew": ((0x0590, 0x05FF), (0xFB1D, 0xFB4F)),
+    "arabic": (
+        (0x0600, 0x06FF),
+        (0x0750, 0x077F),
+        (0x08A0, 0x08FF),
+        (0xFB50, 0xFDFF),
+        (0xFE70, 0xFEFF),
+    ),
+    "cyrillic": (
+        (0x0400, 0x052F),
+        (0x1C80, 0x1C8F),
+        (0x2DE0, 0x2DFF),
+        (0xA640, 0xA69F),
+    ),
+    "greek": ((0x0370, 0x03FF), (0x1F00, 0x1FFF)),
+    "armenian": ((0x0530, 0x058F),),
+    "georgian": ((0x10A0, 0x10FF), (0x2D00, 0x2D2F)),
+    "devanagari": ((0x0900, 0x097F), (0xA8E0, 0xA8FF)),
+    "bengali": ((0x0980, 0x09FF),),
+    "tamil": ((0x0B80, 0x0BFF),),
+    "thai": ((0x0E00, 0x0E7F),),
+    "korean": (
+        (0x1100, 0x11FF),
+        (0x3130, 0x318F),
+        (0xA960, 0xA97F),
+        (0xAC00, 0xD7AF),
+        (0xD7B0, 0xD7FF),
+    ),
+    "japanese": (
+        (0x3040, 0x309F),
+        (0x30A0, 0x30FF),
+        (0x31F0, 0x31FF),
+        (0xFF66, 0xFF9F),
+    ),
+    "cjk": (
+        (0x2E80, 0x2FDF),  # radicals
+        (0x3000, 0x303F),  # symbols and punctuation
+        (0x3400, 0x4DBF),  # extension a
+        (0x4E00, 0x9FFF),  # unified ideographs
+        (0xF900, 0xFAFF),  # compatibility ideographs
+        (0x20000, 0x3134F),  # extensions b-g
+    ),
+}
+
+# the fields of a track that can be matched
+TRACK_FIELDS = ("title", "artists", "album")
+
+
+class LanguageMatcher:
+    """
+    Matches texts containing a character of the given scripts or custom chars.
+
+    The scripts' ranges and the chars are compiled once into a single regex
+    character class, so a match is one C-level scan over the text,
+    and several fields (title, artists, album) are matched in one pass.
+    """
+
+    # never in a character class, joins the fields of a single match
+    SEPARATOR = "\n"
+
+    def __init__(self, scripts: list[str] = (), chars: str = ""):
+        parts = []
+
+        for script in scripts:
+            for start, end in SCRIPTS[script]:
+                parts.append(f"{re.escape(chr(start))}-{re.escape(chr(end))}")
+
+        parts += (re.escape(c) for c in sorted(set(chars) - {self.SEPARATOR}))
+
+        assert parts, "Nothing to match"
+
+        self.pattern = re.compile(f"[{''.join(parts)}]")
+
+    def match(self, *texts: str) -> bool:
+        """Whether any of the texts contains a matching character."""
+        return self.pattern.search(self.SEPARATOR.join(texts)) is not None
@@ -0,0 +1,104 @@
+import random
+
+from server.models.context import Context
+
+
+class LibraryPool:
+    """
+    The tracks of a user's library playlists that were picked for sampling,
+    saved in the user's cache with each playlist's snapshot_id.
+
+    The pool is refreshed lazily: a playlist is only re-read when it's used
+    and its snapshot changed since it was saved.
+
+    The saved pool is capped, so big playlists (followed editorial playlists...)
+    don't grow the user's cache row: only random pages of a big playlist are read,
+    up to `max_playlist_uris` uris, and the least recently picked playlists are dropped
+    past `max_uris` uris in total.
+    """
+
+    max_playlist_uris = 500
+    max_uris = 5_000
+
+    # page size of the playlist items
+    page_size = 100
+
+    def __init__(self, ctx: Context, key: str = "library_pool"):
+        self.ctx = ctx
+        self.key = key
+
+        # playlist id -> {"snapshot_id", "uris"}, least recently picked first
+        self.playlists: dict[str, dict] = {}
+        self.changed = False
+
+        # playlists re-read in this run
+        self.reads = 0
+
+    async def load(self, playlists: list) -> "LibraryPool":
+        """
+        Load the pool for the user's current `playlists` (SimplePlaylist objects),
+        dropping the playlists that are no longer in the library.
+        """
+
+        saved = await self.ctx.db.load_cache(self.ctx.user, self.key) or {}
+        current = {p.id for p in playlists}
+
+        self.playlists = {pid: p for pid, p in saved.items() if pid in current}
+        self.changed = len(self.playlists) != len(saved)
+
+        return self
+
+    async def uris(self, playlist) -> list[str]:
+        """The uris of the playlist, re-read only if its snapshot changed."""
+
+        if playlist.track_count == 0:
+            return []
+
+        entry = self.playlists.pop(playlist.id, None)
+
+        if entry is None or entry["snapshot_id"] != playlist.snapshot_id:
+            uris = await self._read(playlist)
+            self.reads += 1
+
+            entry = dict(snapshot_id=playlist.snapshot_id, uris=uris)
+            self.changed = True
+        else:
+            uris = entry["uris"]
+
+        # most recently picked last
+        self.playlists[playlist.id] = entry
+
+        return uris
+
+    async def _read(self, playlist) -> list[str]:
+        """The uris of the playlist, or of random pages of it if it's too big."""
+
+        if playlist.track_count <= self.max_playlist_uris:
+            return await self.ctx.sc.get_playlist_items(
+                playlist.id, snapshot_id=playlist.snapshot_id
+            )
+
+        # whole pages in the playlist order, the smash takes slices of them
+        pages = range(0, playlist.track_count, self.page_size)
+        offsets = sorted(random.sample(pages, self.max_playlist_uris // self.page_size))
+
+        return await self.ctx.sc.get_playlist_pages(playlist.id, offsets)
+
+    def _trim(self):
+        """Drop the least recently picked playlists past max_uris."""
+
+        size = sum(len(entry["uris"]) for entry in self.playlists.values())
+
+        for pid in list(self.playlists):
+            if size <= self.max_uris:
+                break
+
+            size -= len(self.playlists.pop(pid)["uris"])
+            self.changed = True
+
+    async def save(self):
+        self._trim()
+
+        if self.changed:
+            await self.ctx.db.save_cache(self.ctx.user, self.key, self.playlists)
+            self.changed = False
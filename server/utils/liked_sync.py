@@ -0,0 +1,284 @@
+import functools
+import logging
+import math
+import typing
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from server.models.context import Context
+from server.utils.spotify import MySpotifyClient
+
+
+# max page size of me/tracks
+PAGE_SIZE = 50
+
+TRACK_URI_PREFIX = "spotify:track:"
+
+
+@dataclass
+class LikedDelta:
+    """What changed in the user's Liked Songs since the last sync."""
+
+    added: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+
+    # the current liked songs uris, newest first (if the sync keeps them)
+    uris: list[str] | None = None
+
+    # whether the whole library was downloaded (first sync or unexplained change)
+    rescanned: bool = False
+    requests: int = 0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.removed)
+
+
+class LikedSync:
+    """
+    Incremental sync of a user's Liked Songs.
+
+    me/tracks is ordered by added_at (newest first), so new likes are always
+    at the head. A sync only pages until it reaches a known (uri, added_at) item.
+
+    The saved total tells whether something was removed below the head:
+    when the new total can't be explained by the new items, the library
+    is downloaded again. The non-track items at the head (local files...)
+    are never saved, so their count is saved with the total.
+
+    The synced tracks are saved in the user's cache under `key`. Every feature
+    keeps its own state, so one feature's sync never hides a change from another.
+    Nothing is saved until `commit()`, which the feature calls once it applied
+    the delta: if applying it fails, the next sync returns the same changes.
+    """
+
+    def __init__(self, ctx: Context, key: str, max_pages: int = 4):
+        self.ctx = ctx
+        self.key = key
+        self.max_pages = max_pages
+
+        self.tracks: list[list[str]] = []
+
+        # the save of the synced state, run by commit()
+        self._pending: typing.Callable[[], typing.Awaitable] | None = None
+
+    @staticmethod
+    def _item(it: dict) -> list[str] | None:
+        """(uri, added_at) of a me/tracks item, or None if it isn't a track."""
+        if not MySpotifyClient._is_track(it):
+            return None
+
+        return [it["track"]["uri"], it["added_at"]]
+
+    # storage
+
+    async def _load(self) -> tuple[list[list[str]], dict] | None:
+        """
+        The saved (uri, added_at) items (at least the head)
+        and the state: {"total", "skipped": the non-track items at the head}.
+        """
+        if state := await self.ctx.db.load_cache(self.ctx.user, self.key):
+            self.tracks = state.pop("tracks")
+            return self.tracks, state
+
+    async def _count_saved(self, uris: list[str]) -> int:
+        """How many of the uris are already saved (with another added_at)."""
+        saved = {uri for uri, _ in self.tracks}
+        return sum(uri in saved for uri in uris)
+
+    async def _diff(self, tracks: list[list[str]]) -> tuple[list[str], list[str]]:
+        """The (added, removed) uris of `tracks` compared to the saved tracks."""
+        old_uris = {uri for uri, _ in self.tracks}
+        new_uris = {uri for uri, _ in tracks}
+
+        added = [uri for uri, _ in tracks if uri not in old_uris]
+        removed = [uri for uri, _ in self.tracks if uri not in new_uris]
+
+        return added, removed
+
+    async def _save_new(self, new: list[list[str]], state: dict):
+        # self.tracks already has the new items at the head (see sync)
+        await self.ctx.db.save_cache(
+            self.ctx.user, self.key, dict(state, tracks=self.tracks)
+        )
+
+    async def _save_all(self, tracks: list[list[str]], state: dict):
+        """Replace the saved tracks."""
+        await self.ctx.db.save_cache(
+            self.ctx.user, self.key, dict(state, tracks=tracks)
+        )
+
+    def _uris(self) -> list[str] | None:
+        return [uri for uri, _ in self.tracks]
+
+    # sync
+
+    async def _rescan(self, requests: int) -> LikedDelta:
+        items = await self.ctx.sc.get_all_playlist_tracks(
+            "likedsongs", tracks_only=False
+        )
+        items = [(it, self._item(it)) for it in items]
+        tracks = [item for _, item in items if item]
+
+        # the non-track items above the newest track
+        skipped = next((i for i, (_, item) in enumerate(items) if item), len(items))
+
+        added, removed = await self._diff(tracks)
+
+        self.tracks = tracks
+        self._pending = functools.partial(
+            self._save_all, tracks, dict(total=len(items), skipped=skipped)
+        )
+
+        return LikedDelta(
+            added=added,
+            removed=removed,
+            uris=self._uris(),
+            rescanned=True,
+            requests=requests + max(1, math.ceil(len(items) / PAGE_SIZE)),
+        )
+
+    async def sync(self) -> LikedDelta:
+        """
+        Sync the Liked Songs and return the delta, call `commit()` once it's applied.
+        Requires `ctx.sc`.
+        """
+
+        if not (state := await self._load()):
+            return await self._rescan(requests=0)
+
+        old, old_state = state
+        old_total, old_skipped = old_state["total"], old_state.get("skipped", 0)
+        known = {(uri, added_at) for uri, added_at in old}
+
+        # page until the first known item
+        new = []
+        skipped = 0  # new items that aren't tracks (local files, removed from spotify)
+        head_skipped = None  # the ones above the newest track
+        requests = 0
+        reached_known = False
+
+        while not reached_known and requests < self.max_pages:
+            page = await self.ctx.sc.get(
+                "me/tracks", limit=PAGE_SIZE, offset=requests * PAGE_SIZE
+            )
+            requests += 1
+            total = page["total"]
+
+            for it in page["items"]:
+                if (item := self._item(it)) is None:
+                    skipped += 1
+                    continue
+
+                if head_skipped is None:
+                    head_skipped = skipped
+
+                if tuple(item) in known:
+                    reached_known = True
+                    break
+
+                new.append(item)
+
+            if not page.get("next"):
+                break
+
+        if not reached_known and total > 0:
+            logging.info(f"{self.key}: no known liked songs in the head, rescanning")
+            return await self._rescan(requests)
+
+        # new total = old total + new items (tracks, and non-tracks that weren't at the head)
+        # - re-liked songs' old positions, anything else means something was removed below the head.
+        relikes = await self._count_saved([uri for uri, _ in new]) if new else 0
+
+        if total != old_total + skipped - old_skipped + len(new) - relikes:
+            logging.info(
+                f"{self.key}: liked songs total changed {old_total} -> {total}, rescanning"
+            )
+            return await self._rescan(requests)
+
+        head_skipped = skipped if head_skipped is None else head_skipped
+
+        # a re-liked song moves to the head with a new added_at
+        new_uris = {uri for uri, _ in new}
+        self.tracks = new + [t for t in self.tracks if t[0] not in new_uris]
+
+        if new or head_skipped != old_skipped:
+            self._pending = functools.partial(
+                self._save_new, new, dict(total=total, skipped=head_skipped)
+            )
+
+        return LikedDelta(
+            added=[uri for uri, _ in new],
+            uris=self._uris(),
+            requests=requests,
+        )
+
+    async def commit(self):
+        """Save the state of the last sync, once its delta was applied."""
+        if self._pending is not None:
+            await self._pending()
+            self._pending = None
+
+
+class LikedTableSync(LikedSync):
+    """
+    Liked Songs sync saved in the user_liked_tracks table (one row per track)
+    instead of a json array, so a sync writes only the changed rows.
+
+    Only the head is loaded, and only the state (total, skipped) is kept in the user's cache.
+    """
+
+    @staticmethod
+    def _to_row(item: list[str]) -> tuple[str, datetime | None]:
+        uri, added_at = item
+        return (
+            uri.removeprefix(TRACK_URI_PREFIX),
+            datetime.fromisoformat(added_at) if added_at else None,
+        )
+
+    @staticmethod
+    def _from_row(track_id: str, added_at: datetime | None) -> list[str]:
+        if added_at:
+            added_at = added_at.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+        return [TRACK_URI_PREFIX + track_id, added_at]
+
+    async def _load(self) -> tuple[list[list[str]], dict] | None:
+        if not (state := await self.ctx.db.load_cache(self.ctx.user, self.key)):
+            return None
+
+        head = await self.ctx.db.get_liked_head(
+            self.ctx.user, self.max_pages * PAGE_SIZE
+        )
+        return [self._from_row(*row) for row in head], state
+
+    async def _count_saved(self, uris: list[str]) -> int:
+        return await self.ctx.db.count_liked_tracks(
+            self.ctx.user, [uri.removeprefix(TRACK_URI_PREFIX) for uri in uris]
+        )
+
+    async def _save_new(self, new: list[list[str]], state: dict):
+        if new:
+            await self.ctx.db.add_liked_tracks(
+                self.ctx.user, [self._to_row(item) for item in new]
+            )
+        await self.ctx.db.save_cache(self.ctx.user, self.key, state)
+
+    async def _diff(self, tracks: list[list[str]]) -> tuple[list[str], list[str]]:
+        added, removed = await self.ctx.db.sync_liked_tracks(
+            self.ctx.user, [self._to_row(item) for item in tracks], dry_run=True
+        )
+
+        return (
+            [TRACK_URI_PREFIX + track_id for track_id in added],
+            [TRACK_URI_PREFIX + track_id for track_id in removed],
+        )
+
+    async def _save_all(self, tracks: list[list[str]], state: dict):
+        await self.ctx.db.sync_liked_tracks(
+            self.ctx.user, [self._to_row(item) for item in tracks]
+        )
+        await self.ctx.db.save_cache(self.ctx.user, self.key, state)
+
+    def _uris(self) -> list[str] | None:
+        return None
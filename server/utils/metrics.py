@@ -0,0 +1,311 @@
+import bisect
+import functools
+import inspect
+import time
+import typing
+
+# seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Metric:
+    """
+    A metric and its children, one per label values.
+
+    The children are created (and their labels formatted) once, on the first
+    `labels(...)` call for their values, so recording is a dict lookup
+    and an addition. Hot paths can keep the child around instead.
+    """
+
+    type = ""
+
+    # appended to the name of the family (HELP/TYPE) and of its samples
+    suffix = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.family = name + self.suffix
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        self._children: dict[tuple, typing.Any] = {}
+
+    def _child(self, labels: str):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        child = self._children.get(values)
+
+        if child is None:
+            assert len(values) == len(self.labelnames), f"{self.name}: wrong labels"
+            child = self._children[values] = self._child(
+                _format_labels(self.labelnames, values)
+            )
+
+        return child
+
+    def _samples(self) -> typing.Iterator[str]:
+        for child in list(self._children.values()):
+            yield from child.samples(self.family)
+
+    def render(self) -> str:
+        return "\n".join(
+            (
+                f"# HELP {self.family} {self.documentation}",
+                f"# TYPE {self.family} {self.type}",
+                *self._samples(),
+            )
+        )
+
+
+class _CounterChild:
+    __slots__ = ("_labels", "value")
+
+    def __init__(self, labels: str):
+        self._labels = labels
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def samples(self, name: str):
+        yield f"{name}{self._labels} {self.value}"
+
+
+class Counter(Metric):
+    type = "counter"
+    suffix = "_total"
+
+    def _child(self, labels):
+        return _CounterChild(labels)
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class _GaugeChild:
+    __slots__ = ("_labels", "value", "function")
+
+    def __init__(self, labels: str):
+        self._labels = labels
+        self.value = 0.0
+        self.function: typing.Callable[[], float] | None = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: typing.Callable[[], float]):
+        """Read the value from `function()` when the metrics are rendered."""
+        self.function = function
+
+    def samples(self, name: str):
+        value = self.value if self.function is None else self.function()
+        yield f"{name}{self._labels} {value}"
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def _child(self, labels):
+        return _GaugeChild(labels)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def set_function(self, function: typing.Callable[[], float]):
+        self.labels().set_function(function)
+
+
+class _HistogramChild:
+    __slots__ = ("_labels", "_bucket_labels", "buckets", "counts", "sum", "count")
+
+    def __init__(self, labels: str, buckets: tuple[float, ...]):
+        self._labels = labels
+        self.buckets = buckets
+
+        # the le="..." label of every bucket, merged with the child's labels
+        inner = labels[1:-1] + "," if labels else ""
+        self._bucket_labels = [
+            f'{{{inner}le="{bound}"}}' for bound in (*buckets, "+Inf")
+        ]
+
+        # per bucket (not cumulative), the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name: str):
+        cumulative = 0
+
+        for labels, count in zip(self._bucket_labels, self.counts):
+            cumulative += count
+            yield f"{name}_bucket{labels} {cumulative}"
+
+        yield f"{name}_sum{self._labels} {self.sum}"
+        yield f"{name}_count{self._labels} {self.count}"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _child(self, labels):
+        return _HistogramChild(labels, self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        assert metric.name not in self.metrics, f"Duplicate metric {metric.name}"
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        return "\n".join(m.render() for m in self.metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+## Metrics ##
+
+SPOTIFY_REQUEST_SECONDS = REGISTRY.register(
+    Histogram(
+        "muzee_spotify_request_seconds",
+        "Spotify API requests, by endpoint template and status",
+        ("method", "endpoint", "status"),
+    )
+)
+
+SPOTIFY_RATE_LIMITED = REGISTRY.register(
+    Counter(
+        "muzee_spotify_rate_limited",
+        "Spotify API responses with a 429 status, by endpoint template",
+        ("endpoint",),
+    )
+)
+
+SPOTIFY_TOKEN_REFRESHES = REGISTRY.register(
+    Counter(
+        "muzee_spotify_token_refreshes",
+        "Access token refreshes, by result (ok / invalid_grant)",
+        ("result",),
+    )
+)
+
+DB_QUERY_SECONDS = REGISTRY.register(
+    Histogram(
+        "muzee_db_query_seconds",
+        "Database method calls, by method",
+        ("method",),
+    )
+)
+
+DB_POOL_CONNECTIONS = REGISTRY.register(
+    Gauge(
+        "muzee_db_pool_connections",
+        "Connections of the asyncpg pool, by state (open / idle / max)",
+        ("state",),
+    )
+)
+
+TASK_SWEEP_SECONDS = REGISTRY.register(
+    Histogram(
+        "muzee_task_sweep_seconds",
+        "Feature task sweeps, by feature",
+        ("feature",),
+        buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600),
+    )
+)
+
+TASK_USERS = REGISTRY.register(
+    Counter(
+        "muzee_task_users",
+        "Users processed by the feature task sweeps, by feature",
+        ("feature",),
+    )
+)
+
+TASK_FAILURES = REGISTRY.register(
+    Counter(
+        "muzee_task_failures",
+        "Users whose feature run failed or timed out, by feature",
+        ("feature",),
+    )
+)
+
+
+WRITE_BUFFER_DROPPED = REGISTRY.register(
+    Counter(
+        "muzee_write_buffer_dropped",
+        "Buffered writes dropped after failing twice, by kind (events)",
+        ("kind",),
+    )
+)
+
+
+## Helpers ##
+
+
+def timed_methods(histogram: Histogram):
+    """
+    Class decorator to observe the duration of the public async methods
+    in `histogram`, labeled by the method name. The children are created upfront.
+    """
+
+    def decorator(cls):
+        for name, func in list(vars(cls).items()):
+            if name.startswith("_") or not inspect.iscoroutinefunction(func):
+                continue
+
+            setattr(cls, name, _timed(func, histogram.labels(name)))
+
+        return cls
+
+    return decorator
+
+
+def _timed(func, child: _HistogramChild):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            child.observe(time.perf_counter() - start)
+
+    return wrapper
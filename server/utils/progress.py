@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import typing
+import uuid
+from collections import Counter
+
+from server.utils import timing
+from server.utils.cache import LRUCache
+
+
+class Run:
+    """
+    A long-running action running in the background (see @background).
+    Reports progress counters (pages read, tracks matched, tracks written...)
+    to its subscribers, and finally its result or error.
+    """
+
+    def __init__(self, name: str, user_id):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.user_id = user_id
+
+        self.status = "running"  # running / done / failed
+        self.progress: Counter[str] = Counter()
+        self.result: typing.Any = None
+        self.error: str | None = None
+
+        self.task: asyncio.Task | None = None
+        self._subscribers: set[asyncio.Queue] = set()
+
+    @property
+    def finished(self) -> bool:
+        return self.status != "running"
+
+    def _publish(self, event: str, data: typing.Any):
+        for queue in self._subscribers:
+            queue.put_nowait((event, data))
+
+    def report(self, **counts: int):
+        """Add to the progress counters."""
+        self.progress.update(counts)
+        self._publish("progress", dict(self.progress))
+
+    def finish(self, result: typing.Any):
+        self.status = "done"
+        self.result = result
+        self._publish("done", result)
+
+    def fail(self, error: str):
+        self.status = "failed"
+        self.error = error
+        self._publish("error", dict(detail=error))
+
+    async def events(self) -> typing.AsyncIterator[tuple[str, typing.Any]]:
+        """
+        Yield the (event, data) of the run: the current progress,
+        every progress report, and the final result or error.
+        """
+
+        queue = asyncio.Queue()
+        self._subscribers.add(queue)
+
+        try:
+            yield "progress", dict(self.progress)
+
+            if self.status == "done":
+                yield "done", self.result
+                return
+
+            if self.status == "failed":
+                yield "error", dict(detail=self.error)
+                return
+
+            while True:
+                event, data = await queue.get()
+                yield event, data
+
+                if event != "progress":
+                    return
+        finally:
+            self._subscribers.discard(queue)
+
+    def to_dict(self) -> dict:
+        return dict(
+            run_id=self.id,
+            name=self.name,
+            status=self.status,
+            progress=dict(self.progress),
+            result=self.result,
+            error=self.error,
+        )
+
+
+class RunTracker:
+    """
+    The background runs of this process, kept for `ttl` seconds after they start
+    so their results can still be fetched.
+
+    The cache can evict a run that is still running, so the tasks are
+    kept in `tasks` until they're done (the event loop only keeps weak references).
+    """
+
+    def __init__(self, max_runs: int = 1000, ttl: float = 3600):
+        self.runs = LRUCache(max_runs, ttl=ttl)
+        self.tasks: set[asyncio.Task] = set()
+
+    @classmethod
+    def from_config(cls, config) -> "RunTracker":
+        return cls(
+            max_runs=config.getint("runs", "max_runs", fallback=1000),
+            ttl=config.getfloat("runs", "ttl", fallback=3600),
+        )
+
+    def start(
+        self,
+        name: str,
+        user_id,
+        action: typing.Callable[[Run], typing.Awaitable[typing.Any]],
+    ) -> Run:
+        """Start `action(run)` in the background, its return value is the run's result."""
+
+        run = Run(name, user_id)
+
+        async def runner():
+            # the run outlives the request that started it (and its Server-Timing)
+            timing.detach()
+
+            try:
+                run.finish(await action(run))
+            except Exception as e:
+                logging.exception(f"Run {name} ({run.id}) failed")
+                run.fail(str(e) or type(e).__name__)
+
+        run.task = asyncio.create_task(runner())
+        self.tasks.add(run.task)
+        run.task.add_done_callback(self.tasks.discard)
+
+        self.runs.set(run.id, run)
+
+        return run
+
+    def get(self, run_id: str) -> Run | None:
+        return self.runs.get(run_id)
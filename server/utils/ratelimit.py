@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+
+
+class TokenBucket:
+    """
+    Async token bucket limiting the request rate to `rate` requests per second,
+    with bursts of up to `burst` requests.
+
+    The bucket can be paused (e.g. when Spotify answers 429 with a Retry-After),
+    which makes every caller wait until the pause is over.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        assert rate > 0 and burst >= 1, "rate and burst must be positive"
+
+        self.rate = rate
+        self.burst = burst
+
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+        # waiters are served in order
+        self.lock = asyncio.Lock()
+
+        # stats
+        self.waiting = 0
+        self.acquired = 0
+        self.throttled = 0  # acquires that had to wait
+        self.throttled_seconds = 0.0  # total time spent waiting
+        self.pauses = 0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        """Wait until a request may be sent."""
+
+        start = time.monotonic()
+        self.waiting += 1
+
+        try:
+            async with self.lock:
+                while True:
+                    now = time.monotonic()
+
+                    if now < self.paused_until:
+                        await asyncio.sleep(self.paused_until - now)
+                        continue
+
+                    self._refill(now)
+
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+
+        self.acquired += 1
+
+        if (waited := time.monotonic() - start) > 0.001:
+            self.throttled += 1
+            self.throttled_seconds += waited
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for `seconds`."""
+
+        paused_until = time.monotonic() + seconds
+
+        if paused_until > self.paused_until:
+            logging.warning(f"Rate limited, pausing all requests for {seconds}s")
+            self.paused_until = paused_until
+            self.pauses += 1
+
+    @property
+    def occupancy(self) -> float:
+        """How much of the burst is currently used (0 - empty bucket, 1 - full)."""
+        self._refill(time.monotonic())
+        return 1 - self.tokens / self.burst
+
+    def stats(self) -> dict:
+        return dict(
+            rate=self.rate,
+            burst=self.burst,
+            occupancy=round(self.occupancy, 3),
+            paused_for=round(max(0.0, self.paused_until - time.monotonic()), 3),
+            waiting=self.waiting,
+            acquired=self.acquired,
+            throttled=self.throttled,
+            throttled_seconds=round(self.throttled_seconds, 3),
+            pauses=self.pauses,
+        )
@@ -0,0 +1,55 @@
+import aiohttp
+
+
+class Sessions:
+    """
+    Long-lived aiohttp sessions, one per upstream host, shared by all the clients.
+    Connections are kept alive and DNS lookups are cached,
+    so requests don't pay for DNS, TCP and TLS setup every time.
+
+    Create in an async context (setup_hook) and close it on shutdown (close_hook).
+    """
+
+    def __init__(
+        self,
+        api_pool_size: int = 100,
+        accounts_pool_size: int = 10,
+        weather_pool_size: int = 10,
+        dns_cache_ttl: int = 300,
+        keepalive_timeout: float = 30,
+        timeout: float = 30,
+    ):
+        def session(pool_size: int) -> aiohttp.ClientSession:
+            return aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=pool_size,
+                    limit_per_host=pool_size,
+                    ttl_dns_cache=dns_cache_ttl,
+                    keepalive_timeout=keepalive_timeout,
+                ),
+                timeout=aiohttp.ClientTimeout(total=timeout),
+            )
+
+        # api.spotify.com
+        self.spotify_api = session(api_pool_size)
+
+        # accounts.spotify.com (tokens)
+        self.spotify_accounts = session(accounts_pool_size)
+
+        # weather.visualcrossing.com
+        self.weather = session(weather_pool_size)
+
+    @classmethod
+    def from_config(cls, config) -> "Sessions":
+        return cls(
+            api_pool_size=config.getint("http", "api_pool_size", fallback=100),
+            accounts_pool_size=config.getint("http", "accounts_pool_size", fallback=10),
+            weather_pool_size=config.getint("http", "weather_pool_size", fallback=10),
+            dns_cache_ttl=config.getint("http", "dns_cache_ttl", fallback=300),
+            keepalive_timeout=config.getfloat("http", "keepalive_timeout", fallback=30),
+            timeout=config.getfloat("http", "timeout", fallback=30),
+        )
+
+    async def close(self):
+        for session in (self.spotify_api, self.spotify_accounts, self.weather):
+            await session.close()
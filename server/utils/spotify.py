@@ -1,11 +1,28 @@
+import asyncio
 import base64
+import functools
+import json as json_lib
 import logging
+import random
+import typing
+import weakref
+import time
+from datetime import datetime, timedelta
 
 import aiohttp
 import asyncspotify.exceptions
 
 from server.database import Database
 from server.models.user import User
+from server.utils.cache import LRUCache
+from server.utils.metrics import (
+    SPOTIFY_RATE_LIMITED,
+    SPOTIFY_REQUEST_SECONDS,
+    SPOTIFY_TOKEN_REFRESHES,
+)
+from server.utils.ratelimit import TokenBucket
+from server.utils.sessions import Sessions
+from server.utils import timing
 
 
 class OAuthError(Exception):
@@ -19,6 +36,44 @@ class CantRefresh(Exception):
 import asyncspotify as sp
 
 
+class UserTokens:
+    """
+    The tokens of a user, shared by all the clients of that user (see Spotify.user_tokens),
+    so a refresh happens once while the other callers wait for it.
+    """
+
+    # refresh this long before the access token expires
+    REFRESH_MARGIN = timedelta(seconds=60)
+
+    __slots__ = (
+        "user_id",
+        "access_token",
+        "refresh_token",
+        "expires_at",
+        "lock",
+        "__weakref__",
+    )
+
+    def __init__(
+        self,
+        user_id,
+        access_token: str,
+        refresh_token: str,
+        expires_at: datetime | None,
+    ):
+        self.user_id = user_id
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.expires_at = expires_at  # naive, local time (like users.expires_at)
+        self.lock = asyncio.Lock()
+
+    def expires_soon(self) -> bool:
+        if self.expires_at is None:  # unknown, rely on 401s
+            return False
+
+        return datetime.now() + self.REFRESH_MARGIN >= self.expires_at
+
+
 class MyAuthenticator(sp.oauth.flows.Authenticator):
     def __init__(
         self, client: "MySpotifyClient", client_id, client_secret, access_token
@@ -36,66 +91,441 @@ class MyAuthenticator(sp.oauth.flows.Authenticator):
         return {"Authorization": f"Bearer {self.access_token}"}
 
 
+# resources whose path segment after them is an id (playlists/{id}/tracks...)
+ID_RESOURCES = frozenset(
+    (
+        "albums",
+        "artists",
+        "audio-analysis",
+        "audio-features",
+        "audiobooks",
+        "categories",
+        "chapters",
+        "episodes",
+        "playlists",
+        "shows",
+        "tracks",
+        "users",
+    )
+)
+
+
+@functools.lru_cache(maxsize=4096)
+def endpoint_template(url: str) -> str:
+    """The endpoint of a request url, with its ids replaced (e.g. playlists/{id}/tracks)."""
+
+    segments = url.split("?", 1)[0].removeprefix(sp.Route.BASE + "/").split("/")
+
+    for i in range(1, len(segments)):
+        # only top-level resources (me/tracks/contains is not an id) and browse/categories/{id}
+        if segments[i - 1] in ID_RESOURCES and (i == 1 or segments[0] == "browse"):
+            segments[i] = "{id}"
+
+    return "/".join(segments)
+
+
+_REFRESHES_OK = SPOTIFY_TOKEN_REFRESHES.labels("ok")
+_REFRESHES_INVALID_GRANT = SPOTIFY_TOKEN_REFRESHES.labels("invalid_grant")
+
+
 class MyHTTP(sp.http.HTTP):
-    async def refresh_token(self):
-        data = dict(
-            grant_type="refresh_token",
-            refresh_token=self.client.refresh_token,
-            client_id=self.client.auth.client_id,
-            client_secret=self.client.auth.client_secret,
-        )
+    # noinspection PyMissingConstructor
+    def __init__(self, client: "MySpotifyClient"):
+        self.client = client
 
-        async with aiohttp.ClientSession() as cs:
-            async with cs.post(
+        # borrowed from the shared sessions, never closed by the client
+        self.session = client.sessions.spotify_api
+
+    async def close(self):
+        pass
+
+    async def refresh_token(self, stale_access_token: str = None):
+        """
+        Refresh the user's access token.
+
+        Only one refresh runs per user, concurrent callers wait for it
+        and then find the token was already refreshed.
+
+        :param stale_access_token: the access token that was rejected.
+            If not given, only refresh if the token is about to expire.
+        """
+
+        tokens = self.client.tokens
+
+        async with tokens.lock:
+            if stale_access_token is None:
+                if not tokens.expires_soon():
+                    return
+            elif tokens.access_token != stale_access_token:
+                return  # refreshed by another caller meanwhile
+
+            data = dict(
+                grant_type="refresh_token",
+                refresh_token=tokens.refresh_token,
+                client_id=self.client.auth.client_id,
+                client_secret=self.client.auth.client_secret,
+            )
+
+            async with self.client.sessions.spotify_accounts.post(
                 "https://accounts.spotify.com/api/token", data=data
             ) as resp:
                 js = await resp.json()
 
-        if js.get("error") == "invalid_grant":
-            raise CantRefresh()
+            if js.get("error") == "invalid_grant":
+                _REFRESHES_INVALID_GRANT.inc()
+                raise CantRefresh()
 
-        old_access_token = self.client.access_token
-        self.client.access_token = js["access_token"]
+            _REFRESHES_OK.inc()
 
-        await self.client.db.pool.execute(
-            """UPDATE users SET access_token = $1 WHERE access_token = $2""",
-            self.client.access_token,
-            old_access_token,
-        )
+            old_access_token = tokens.access_token
+
+            tokens.access_token = js["access_token"]
+            tokens.refresh_token = js.get("refresh_token", tokens.refresh_token)
+            tokens.expires_at = datetime.now() + timedelta(seconds=js["expires_in"])
+
+            if tokens.user_id is None:
+                await self.client.db.replace_access_token(
+                    old_access_token, tokens.access_token
+                )
+            else:
+                await self.client.db.update_tokens(
+                    tokens.user_id,
+                    tokens.access_token,
+                    tokens.refresh_token,
+                    tokens.expires_at,
+                )
+
+    # how many times a request is retried after a 429 before giving up
+    _rate_limited_attempts = 10
+
+    # seconds before retrying a 5xx, doubled on every attempt (with jitter)
+    _server_error_backoff = 0.5
 
-        return
+    async def _send(self, route: sp.Route, data=None, json=None, headers=None):
+        """
+        Send the request through the app-wide rate limiter.
+        Unlike asyncspotify's HTTP.request, a 429 pauses the whole limiter
+        for the Retry-After period instead of just this request.
+        """
+
+        self.client: MySpotifyClient
+        limiter = self.client.limiter
+
+        kw = dict(method=route.method, url=route.url, headers=dict(headers or {}))
+        kw["headers"].update(self.client.auth.header)
+
+        if route.params:
+            kw["params"] = route.params
+
+        if data:
+            kw["data"] = data
+
+        if json:
+            kw["json"] = json
+
+        attempts = rate_limited = 0
+        endpoint = endpoint_template(route.url)
+
+        while attempts < self._attempts:
+            waited = time.perf_counter()
+            await limiter.acquire()
+
+            start = time.perf_counter()
+
+            async with self.session.request(**kw) as r:
+                status_code = r.status
+                text = await r.text()
 
-    async def request(self, *args, _refresh=0, **kwargs):
+            end = time.perf_counter()
+            SPOTIFY_REQUEST_SECONDS.labels(route.method, endpoint, status_code).observe(
+                end - start
+            )
+            # the request's spotify time includes waiting for the rate limiter
+            timing.add("spotify", endpoint, end - waited)
+
+            try:
+                js = json_lib.loads(text)
+            except json_lib.JSONDecodeError:
+                js = None
+
+            if 200 <= status_code < 300:
+                return js
+
+            try:
+                error = js["error"]["message"]
+            except (TypeError, KeyError):
+                error = None
+
+            if status_code == 429:
+                SPOTIFY_RATE_LIMITED.labels(endpoint).inc()
+                rate_limited += 1
+                if rate_limited > self._rate_limited_attempts:
+                    raise sp.HTTPException(r, "Rate limited too many times.")
+
+                limiter.pause(float(r.headers.get("Retry-After", 1)) + 1)
+                continue
+
+            attempts += 1
+
+            if status_code == 400:
+                raise sp.BadRequest(r, error)
+            elif status_code == 401:
+                raise sp.Unauthorized(r, error)
+            elif status_code == 403:
+                raise sp.Forbidden(r, error)
+            elif status_code == 404:
+                raise sp.NotFound(r, error)
+            elif status_code == 405:
+                raise sp.NotAllowed(r, error)
+            elif status_code >= 500:
+                if attempts < self._attempts:
+                    # back off so the retries don't hammer a struggling Spotify
+                    # (the jitter spreads the retries of concurrent requests)
+                    delay = self._server_error_backoff * 2 ** (attempts - 1)
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+                continue
+            else:
+                raise sp.HTTPException(r, f"Unhandled HTTP status code: {status_code}")
+
+        raise sp.HTTPException(r, f"Request failed {self._attempts} times.")
+
+    async def request(self, route: sp.Route, *args, _refresh=0, **kwargs):
         self.client: MySpotifyClient
 
+        kwargs.pop("authorize", None)  # all of our requests are authorized
+
+        # refresh ahead of expiry instead of waiting for a 401
+        if self.client.tokens.expires_soon():
+            await self.refresh_token()
+
+        access_token = self.client.tokens.access_token
+
         try:
-            return await super().request(*args, **kwargs)
+            return await self._send(route, *args, **kwargs)
         except sp.Unauthorized as e:
             if _refresh > 2:
                 raise CantRefresh()
 
-            await self.refresh_token()
+            await self.refresh_token(stale_access_token=access_token)
 
-            return await self.request(*args, _refresh=_refresh + 1, **kwargs)
+            return await self.request(route, *args, _refresh=_refresh + 1, **kwargs)
         except (sp.BadRequest, sp.Forbidden) as e:
-            logging.error(f"{e.__class__.__name__} on {args=} {kwargs=}")
+            logging.error(f"{e.__class__.__name__} on {route=} {kwargs=}")
 
             raise e
 
 
+# view -> (the fields of the playlist items to fetch, compact form of an item)
+PLAYLIST_VIEWS: dict[str, tuple[str, typing.Callable[[dict], typing.Any]]] = {
+    "uris": ("items(is_local,track(type,uri))", lambda it: it["track"]["uri"]),
+    # (uri, title, artists, album)
+    "texts": (
+        "items(is_local,track(type,uri,name,artists(name),album(name)))",
+        lambda it: (
+            it["track"]["uri"],
+            it["track"]["name"],
+            ", ".join(a["name"] for a in it["track"].get("artists") or ()),
+            (it["track"].get("album") or {}).get("name") or "",
+        ),
+    ),
+}
+
+
+class ImageCache(LRUCache):
+    """
+    Playlist id -> cover image url, shared by all the clients.
+
+    Muzee drops a playlist's entry when it writes to the playlist, but only in
+    the process that wrote (the workers write the feature playlists, not the app).
+    Mosaic covers are made of the playlist's first tracks and change with them,
+    so they're only kept for `mosaic_ttl` seconds. Uploaded covers use the cache's ttl.
+    """
+
+    MOSAIC_HOST = "mosaic.scdn.co"
+
+    def __init__(self, maxsize: int, ttl: float = 3600, mosaic_ttl: float = 60):
+        super().__init__(maxsize, ttl=ttl)
+        self.mosaic_ttl = mosaic_ttl
+
+    def set(self, playlist_id: str, url: str, ttl: float | None = None):
+        if ttl is None and self.MOSAIC_HOST in url:
+            ttl = self.mosaic_ttl
+
+        super().set(playlist_id, url, ttl=ttl)
+
+
+class PlaylistCache:
+    """
+    Playlist contents by (playlist_id, snapshot_id, view), shared by all the clients.
+    A snapshot_id changes on every change of the playlist, so entries never go stale.
+
+    Holds up to `max_items` tracks (LRU). Also remembers the latest known snapshot
+    of each playlist, so a write made by Muzee can update the cached contents.
+    """
+
+    def __init__(self, max_items: int = 500_000, max_playlists: int = 50_000):
+        self.contents = LRUCache(max_items, sizeof=lambda items: max(1, len(items)))
+
+        # playlist id -> latest known snapshot id
+        self.snapshots = LRUCache(max_playlists)
+
+    def get(self, playlist_id: str, snapshot_id: str, view: str) -> list | None:
+        return self.contents.get((playlist_id, snapshot_id, view))
+
+    def put(self, playlist_id: str, snapshot_id: str, view: str, items: list):
+        self.contents.set((playlist_id, snapshot_id, view), items)
+        self.snapshots.set(playlist_id, snapshot_id)
+
+    def invalidate(self, playlist_id: str):
+        self.snapshots.pop(playlist_id)
+
+    def update(
+        self,
+        playlist_id: str,
+        snapshot_id: str | None,
+        change: typing.Callable[[list[str]], list[str]],
+    ):
+        """
+        Apply a write of Muzee (`change` of the uris) on the cached contents
+        of the playlist's latest snapshot, and save them under the new snapshot.
+        """
+
+        old_snapshot_id = self.snapshots.pop(playlist_id)
+
+        if snapshot_id is None or old_snapshot_id is None:
+            return
+
+        if (uris := self.get(playlist_id, old_snapshot_id, "uris")) is not None:
+            self.put(playlist_id, snapshot_id, "uris", change(uris))
+
+    def stats(self) -> dict:
+        return self.contents.stats()
+
+
+class PlaylistWriter:
+    """
+    Writes tracks to playlists, in batches of 100 (the API maximum).
+    All of Muzee's playlist track writes go through here.
+
+    Each operation returns the playlist's snapshot_id after the write,
+    or None if it isn't known. The cached contents of the playlist
+    (see PlaylistCache) are updated to the new snapshot, and its cached
+    image is dropped (the cover of a playlist without one is a mosaic of its tracks).
+    """
+
+    BATCH_SIZE = 100
+
+    def __init__(self, sc: "MySpotifyClient", window: int = 4):
+        self.sc = sc
+        self.window = window
+
+    def _batches(self, uris: list[str]) -> list[list[str]]:
+        return [
+            uris[i : i + self.BATCH_SIZE] for i in range(0, len(uris), self.BATCH_SIZE)
+        ]
+
+    async def replace(self, playlist_id: str, uris: list[str]) -> str | None:
+        """
+        Replace the playlist's tracks with `uris` (in order).
+        The first batch replaces the playlist with a single PUT, the rest are appended.
+        """
+
+        uris = list(uris)
+        js = await self.sc.put(
+            f"playlists/{playlist_id}/tracks", uris=uris[: self.BATCH_SIZE], body=True
+        )
+        snapshot_id = js.get("snapshot_id") if js else None
+        self.sc.report(tracks_written=len(uris[: self.BATCH_SIZE]))
+
+        if snapshot_id:
+            self.sc.playlist_cache.put(
+                playlist_id, snapshot_id, "uris", uris[: self.BATCH_SIZE]
+            )
+        else:
+            self.sc.playlist_cache.invalidate(playlist_id)
+
+        if len(uris) > self.BATCH_SIZE:
+            snapshot_id = await self.add(playlist_id, uris[self.BATCH_SIZE :])
+
+        self.sc.image_cache.pop(playlist_id)
+        return snapshot_id
+
+    async def add(self, playlist_id: str, uris: list[str]) -> str | None:
+        """
+        Append `uris` to the playlist.
+        Batches are sent one after the other to keep the order.
+        """
+
+        snapshot_id = None
+
+        for batch in self._batches(list(uris)):
+            js = await self.sc.post(f"playlists/{playlist_id}/tracks", uris=batch)
+            self.sc.report(tracks_written=len(batch))
+            snapshot_id = js.get("snapshot_id") if js else None
+            self.sc.playlist_cache.update(
+                playlist_id, snapshot_id, lambda old: old + batch
+            )
+
+        self.sc.image_cache.pop(playlist_id)
+        return snapshot_id
+
+    async def remove(self, playlist_id: str, uris: list[str]) -> str | None:
+        """
+        Remove every occurrence of `uris` from the playlist.
+        Batches are independent, so they are sent concurrently (`window` at a time).
+        """
+
+        batches = self._batches(list(uris))
+        sem = asyncio.Semaphore(self.window)
+
+        async def remove_batch(batch: list[str]) -> dict | None:
+            async with sem:
+                js = await self.sc.delete(
+                    f"playlists/{playlist_id}/tracks",
+                    tracks=[{"uri": uri} for uri in batch],
+                )
+                self.sc.report(tracks_written=len(batch))
+                return js
+
+        responses = await asyncio.gather(*(remove_batch(b) for b in batches))
+
+        # with concurrent batches there's no telling which snapshot is the last one
+        snapshot_id = None
+
+        if len(responses) == 1 and responses[0]:
+            snapshot_id = responses[0].get("snapshot_id")
+
+        removed = set(uris)
+        self.sc.playlist_cache.update(
+            playlist_id, snapshot_id, lambda old: [u for u in old if u not in removed]
+        )
+
+        self.sc.image_cache.pop(playlist_id)
+        return snapshot_id
+
+
 class MySpotifyClient(sp.Client):
     # noinspection PyMissingConstructor
     def __init__(
         self,
         client_id: str,
         client_secret: str,
-        access_token: str,
-        refresh_token: str,
+        tokens: UserTokens,
         db: Database,
+        limiter: TokenBucket,
+        sessions: Sessions,
+        playlist_cache: PlaylistCache,
+        image_cache: ImageCache,
     ):
-        self.access_token = access_token
-        self.refresh_token = refresh_token
+        self.tokens = tokens
         self.db = db
+        self.limiter = limiter
+        self.sessions = sessions
+        self.playlist_cache = playlist_cache
+        self.image_cache = image_cache
+
+        # the background run to report progress to (see Context.progress)
+        self.progress = None
 
         self.client_id = client_id
         self.client_secret = client_secret
@@ -107,9 +537,24 @@ class MySpotifyClient(sp.Client):
             access_token=self.access_token,
         )
         self.http = MyHTTP(self)
+        self.writer = PlaylistWriter(self)
+
+    @property
+    def access_token(self) -> str:
+        return self.tokens.access_token
+
+    @property
+    def refresh_token(self) -> str:
+        return self.tokens.refresh_token
+
+    def report(self, **counts: int):
+        if self.progress is not None:
+            self.progress.report(**counts)
 
     async def get(self, endpoint: str, **params):
-        return await self.http.request(sp.Route("GET", endpoint, **params))
+        js = await self.http.request(sp.Route("GET", endpoint, **params))
+        self.report(pages_read=1)
+        return js
 
     async def put(self, endpoint: str, **params):
         is_body = params.pop("body", False)
@@ -127,6 +572,8 @@ class MySpotifyClient(sp.Client):
 
     @staticmethod
     def _is_track(it: dict) -> bool:
+        if it.get("track") is None:  # removed from spotify
+            return False
         if it["track"]["uri"] is None:
             return False
         if it["track"].get("type", "track") != "track":
@@ -138,69 +585,128 @@ class MySpotifyClient(sp.Client):
 
         return True
 
-    async def get_all_playlist_tracks(self, playlist_id: str, **kw) -> list[dict]:
+    async def get_all_playlist_tracks(
+        self, playlist_id: str, window: int = 8, tracks_only: bool = True, **kw
+    ) -> list[dict]:
         """
         Return all the tracks in a playlist
-        """
 
-        tracks = []
-        offset = 0
-        limit = 50
+        The first page tells the total, then the rest of the pages
+        are fetched concurrently, `window` at a time.
+
+        :param tracks_only: Skip the items that aren't tracks (local files, episodes...)
+        """
 
         if playlist_id == "likedsongs":
             kw.pop("fields", None)
             endpoint = f"me/tracks"
+            limit = 50  # max page size of me/tracks
         else:
             endpoint = f"playlists/{playlist_id}/tracks"
+            limit = 100  # max page size of playlist items
 
-        while True:
-            js = await self.get(endpoint, limit=limit, offset=offset, **kw)
-            items = js["items"]
-            tracks += [t for t in items if MySpotifyClient._is_track(t)]
+            if fields := kw.get("fields"):
+                kw["fields"] = f"{fields},total"
 
-            if len(items) < limit:
-                break
+        js = await self.get(endpoint, limit=limit, offset=0, **kw)
 
-            offset += limit
+        sem = asyncio.Semaphore(window)
 
-        return tracks
+        async def get_page(offset: int) -> list[dict]:
+            async with sem:
+                page = await self.get(endpoint, limit=limit, offset=offset, **kw)
+                return page["items"]
 
-    async def add_tracks_to_playlist(self, playlist_id: str, tracks_ids: list[str]):
-        """
-        Add tracks to a playlist
-        """
+        # gather keeps the pages in order
+        pages = [js["items"]] + await asyncio.gather(
+            *(get_page(offset) for offset in range(limit, js["total"], limit))
+        )
 
-        limit = 50
+        return [
+            t
+            for items in pages
+            for t in items
+            if not tracks_only or MySpotifyClient._is_track(t)
+        ]
 
-        while tracks_ids:
-            await self.post(f"playlists/{playlist_id}/tracks", uris=tracks_ids[:limit])
-            tracks_ids = tracks_ids[limit:]
+    async def get_playlist_pages(
+        self, playlist_id: str, offsets: list[int], view: str = "uris", window: int = 8
+    ) -> list:
+        """
+        Return the items of the playlist pages (of 100 items) at `offsets`,
+        in a compact form (see PLAYLIST_VIEWS). Not cached.
+        """
 
-    async def delete_playlist_tracks(self, playlist_id: str, tracks_ids: list[str]):
+        fields, compact = PLAYLIST_VIEWS[view]
+        sem = asyncio.Semaphore(window)
+
+        async def get_page(offset: int) -> list[dict]:
+            async with sem:
+                page = await self.get(
+                    f"playlists/{playlist_id}/tracks",
+                    limit=100,
+                    offset=offset,
+                    fields=fields,
+                )
+                return page["items"]
+
+        # gather keeps the pages in order
+        pages = await asyncio.gather(*(get_page(offset) for offset in offsets))
+
+        return [
+            compact(t) for items in pages for t in items if MySpotifyClient._is_track(t)
+        ]
+
+    async def get_playlist_items(
+        self, playlist_id: str, view: str = "uris", snapshot_id: str | None = None
+    ) -> list:
         """
-        Remove the tracks from a playlist
+        Return the playlist's items in a compact form (see PLAYLIST_VIEWS),
+        cached by the playlist's snapshot.
+
+        :param snapshot_id: The playlist's current snapshot, if known.
+            Otherwise a light `fields=snapshot_id` request probes it.
         """
 
-        limit = 50
+        if snapshot_id is None:
+            js = await self.get(f"playlists/{playlist_id}", fields="snapshot_id")
+            snapshot_id = js["snapshot_id"]
 
-        while tracks_ids:
-            await self.delete(
-                f"playlists/{playlist_id}/tracks",
-                tracks=[{"uri": uri} for uri in tracks_ids[:limit]],
-            )
-            tracks_ids = tracks_ids[limit:]
+        items = self.playlist_cache.get(playlist_id, snapshot_id, view)
+
+        if items is None:
+            fields, compact = PLAYLIST_VIEWS[view]
+            items = [
+                compact(it)
+                for it in await self.get_all_playlist_tracks(playlist_id, fields=fields)
+            ]
+            self.playlist_cache.put(playlist_id, snapshot_id, view, items)
+
+        return items
 
     async def get_image(self, playlist_id: str) -> str | None:
         """
         Get the image of a playlist
+
+        Found images are cached by playlist (see ImageCache).
         """
 
+        if url := self.image_cache.get(playlist_id):
+            return url
+
         try:
             js = await self.get(f"playlists/{playlist_id}/images")
-            return js[0]["url"] if js else None
         except sp.NotFound:
             return None
 
+        if not js:
+            return None
+
+        url = js[0]["url"]
+        self.image_cache.set(playlist_id, url)
+
+        return url
+
 
 def sp_endpoint(keep_client: bool = False):
     """
@@ -224,15 +730,19 @@ def sp_endpoint(keep_client: bool = False):
             ), "You must provide either a user object or an access token and a refresh token"
 
             if user:
-                access_token = user.access_token
-                refresh_token = user.refresh_token
+                tokens = self.user_tokens(user)
+            else:
+                tokens = UserTokens(None, access_token, refresh_token, None)
 
             sc = MySpotifyClient(
                 client_id=self.client_id,
                 client_secret=self.client_secret,
-                access_token=access_token,
-                refresh_token=refresh_token,
+                tokens=tokens,
                 db=self.db,
+                limiter=self.limiter,
+                sessions=self.sessions,
+                playlist_cache=self.playlist_cache,
+                image_cache=self.image_cache,
             )
 
             try:
@@ -260,6 +770,10 @@ class Spotify:
         scope: str,
         server_url: str,
         db: Database,
+        limiter: TokenBucket,
+        sessions: Sessions,
+        playlist_cache: PlaylistCache,
+        image_cache: ImageCache,
     ):
         self.client_id = client_id
         self.client_secret = client_secret
@@ -267,6 +781,75 @@ class Spotify:
         self.server_url = server_url
         self.db = db
 
+        # shared by all the clients, since all users share the client_id's rate limit
+        self.limiter = limiter
+
+        # shared connection pools, owned (and closed) by the app
+        self.sessions = sessions
+
+        # playlist contents by snapshot, shared by all the clients
+        self.playlist_cache = playlist_cache
+
+        # playlist id -> image url, shared by all the clients
+        self.image_cache = image_cache
+
+        # user id -> the tokens shared by the user's live clients
+        self._tokens: weakref.WeakValueDictionary[typing.Any, UserTokens] = (
+            weakref.WeakValueDictionary()
+        )
+
+    def user_tokens(self, user: User) -> UserTokens:
+        """
+        Return the tokens of the user, shared with the user's other live clients.
+        """
+
+        tokens = self._tokens.get(user.id)
+
+        if tokens is None:
+            tokens = UserTokens(
+                user.id, user.access_token, user.refresh_token, user.expires_at
+            )
+            self._tokens[user.id] = tokens
+
+        elif (
+            user.expires_at is not None
+            and not tokens.lock.locked()
+            and (tokens.expires_at is None or user.expires_at > tokens.expires_at)
+        ):
+            # the user was loaded after a refresh made elsewhere (another process)
+            tokens.access_token = user.access_token
+            tokens.refresh_token = user.refresh_token
+            tokens.expires_at = user.expires_at
+
+        return tokens
+
+    @classmethod
+    def from_config(
+        cls, config, server_url: str, db: Database, sessions: Sessions
+    ) -> "Spotify":
+        return cls(
+            client_id=config.get("spotify", "client_id"),
+            client_secret=config.get("spotify", "client_secret"),
+            scope=config.get("spotify", "scope"),
+            server_url=server_url,
+            db=db,
+            limiter=TokenBucket(
+                rate=config.getfloat("spotify", "rate_limit", fallback=10),
+                burst=config.getint("spotify", "rate_burst", fallback=20),
+            ),
+            sessions=sessions,
+            playlist_cache=PlaylistCache(
+                max_items=config.getint(
+                    "spotify", "playlist_cache_size", fallback=500_000
+                ),
+            ),
+            image_cache=ImageCache(
+                config.getint("spotify", "image_cache_size", fallback=10_000),
+                ttl=config.getfloat("spotify", "image_cache_ttl", fallback=3600),
+                mosaic_ttl=config.getfloat("spotify", "image_mosaic_ttl", fallback=60),
+            ),
+        )
+
     async def get_access_token_from_code(self, code: str):
         """
         Get the access token & refresh token from Spotify using the code
@@ -285,16 +868,15 @@ class Spotify:
             ).decode()
         }
 
-        async with aiohttp.ClientSession() as cs:
-            async with cs.post(
-                "https://accounts.spotify.com/api/token", data=data, headers=headers
-            ) as resp:
-                js = await resp.json()
+        async with self.sessions.spotify_accounts.post(
+            "https://accounts.spotify.com/api/token", data=data, headers=headers
+        ) as resp:
+            js = await resp.json()
 
-                if resp.status != 200:
-                    raise OAuthError(js)
+            if resp.status != 200:
+                raise OAuthError(js)
 
-                return js
+            return js
 
     async def refresh_access_token(self, refresh_token: str):
         """
@@ -307,16 +889,15 @@ class Spotify:
         )
 
         auth = aiohttp.BasicAuth(self.client_id, self.client_secret)
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                self.API_ENDPOINT + "/oauth2/token", data=data, auth=auth
-            ) as resp:
-                js = await resp.json()
+        async with self.sessions.spotify_accounts.post(
+            "https://accounts.spotify.com/api/token", data=data, auth=auth
+        ) as resp:
+            js = await resp.json()
 
-                if resp.status != 200:
-                    raise OAuthError(js)
+            if resp.status != 200:
+                raise OAuthError(js)
 
-                return js
+            return js
 
     @sp_endpoint(keep_client=True)
     async def get_client(self, sc: MySpotifyClient) -> MySpotifyClient:
@@ -0,0 +1,114 @@
+import asyncio
+import copy
+import logging
+import time
+import typing
+from dataclasses import dataclass, field
+
+from server.models.context import Context
+from server.models.user import User
+from server.utils.metrics import TASK_FAILURES, TASK_SWEEP_SECONDS, TASK_USERS
+
+
+# stable offset (in minutes) of a user inside an interval of `period` minutes:
+# the last 7 hex digits (28 bits) of the uuid, so users are spread evenly over the interval
+PHASE_SQL = "(('x' || right(id::text, 7))::bit(28)::int % {period})"
+
+
+@dataclass
+class SweepResult:
+    """Summary of a single task sweep over a list of users."""
+
+    name: str
+    total: int = 0
+    succeeded: int = 0
+    timed_out: int = 0
+    elapsed: float = 0.0
+
+    # user id -> the exception that failed the run
+    failed: dict[str, BaseException] = field(default_factory=dict)
+
+    def __str__(self):
+        return (
+            f"{self.name} sweep: {self.succeeded}/{self.total} ok, "
+            f"{len(self.failed)} failed ({self.timed_out} timed out) "
+            f"in {self.elapsed:.2f}s"
+        )
+
+
+class TaskRunner:
+    """
+    Run a feature action for many users concurrently.
+
+    At most `concurrency` users are processed at the same time, every user
+    gets `timeout` seconds, and a failing user never affects the others.
+    """
+
+    def __init__(self, ctx: Context, concurrency: int = 10, timeout: float = 300):
+        assert concurrency > 0, "concurrency must be positive"
+
+        self.ctx = ctx
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    @classmethod
+    def from_config(cls, ctx: Context, config) -> "TaskRunner":
+        return cls(
+            ctx,
+            concurrency=config.getint("tasks", "concurrency", fallback=10),
+            timeout=config.getfloat("tasks", "user_timeout", fallback=300),
+        )
+
+    async def _run_user(
+        self,
+        sem: asyncio.Semaphore,
+        result: SweepResult,
+        user: User,
+        action: typing.Callable[..., typing.Awaitable],
+    ):
+        async with sem:
+            ctx = copy.copy(self.ctx)
+            ctx.user = user
+
+            logging.info(f"Running {result.name} for {user.username}")
+
+            try:
+                await asyncio.wait_for(action(ctx=ctx), self.timeout)
+            except asyncio.TimeoutError as e:
+                logging.warning(
+                    f"{result.name} for {user.username} timed out after {self.timeout}s"
+                )
+                result.timed_out += 1
+                result.failed[user.id] = e
+            except Exception as e:
+                logging.error(f"{result.name} for {user.username} failed", exc_info=e)
+                result.failed[user.id] = e
+            else:
+                result.succeeded += 1
+
+    async def run(
+        self,
+        name: str,
+        users: typing.Iterable[User],
+        action: typing.Callable[..., typing.Awaitable],
+    ) -> SweepResult:
+        """
+        Run `action(ctx=...)` for every user and return the sweep summary.
+        """
+
+        users = list(users)
+        result = SweepResult(name=name, total=len(users))
+        sem = asyncio.Semaphore(self.concurrency)
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(self._run_user(sem, result, user, action) for user in users)
+        )
+        result.elapsed = time.perf_counter() - start
+
+        TASK_SWEEP_SECONDS.labels(name).observe(result.elapsed)
+        TASK_USERS.labels(name).inc(result.total)
+        TASK_FAILURES.labels(name).inc(len(result.failed))
+
+        logging.info(str(result))
+        return result
@@ -0,0 +1,121 @@
+import contextvars
+import functools
+import inspect
+import time
+
+
+class RequestTiming:
+    """
+    Where the time of a request went: the database, Spotify, or the app itself.
+
+    The Database methods and the Spotify requests add their durations
+    to the timing of the current request (see `add`), nothing is recorded
+    outside of a request. Concurrent calls add up, so db + spotify can
+    exceed the request's duration.
+    """
+
+    def __init__(self, keep_calls: bool = False):
+        self.start = time.perf_counter()
+
+        self.db = 0.0
+        self.spotify = 0.0
+        self.spotify_calls = 0
+
+        # (kind, name, seconds) of every call, if kept (for the slow requests log)
+        self.calls: list[tuple[str, str, float]] | None = [] if keep_calls else None
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def add(self, kind: str, name: str, seconds: float):
+        if kind == "db":
+            self.db += seconds
+        else:
+            self.spotify += seconds
+            self.spotify_calls += 1
+
+        if self.calls is not None:
+            self.calls.append((kind, name, seconds))
+
+    def header(self, elapsed: float) -> str:
+        """The Server-Timing header value (durations in milliseconds)."""
+
+        app = max(0.0, elapsed - self.db - self.spotify)
+
+        return (
+            f"db;dur={self.db * 1000:.1f}, "
+            f"spotify;dur={self.spotify * 1000:.1f}, "
+            f'spotify-calls;desc="{self.spotify_calls}", '
+            f"app;dur={app * 1000:.1f}, "
+            f"total;dur={elapsed * 1000:.1f}"
+        )
+
+    def breakdown(self) -> str:
+        """Every call and its duration, in the order they finished."""
+        return ", ".join(
+            f"{kind} {name} {seconds * 1000:.1f}ms"
+            for kind, name, seconds in self.calls or ()
+        )
+
+
+_current: contextvars.ContextVar[RequestTiming | None] = contextvars.ContextVar(
+    "request_timing", default=None
+)
+
+# set while a timed Database method runs, so the nested calls aren't counted twice
+_in_db: contextvars.ContextVar[bool] = contextvars.ContextVar("in_db", default=False)
+
+
+def start(keep_calls: bool = False) -> RequestTiming:
+    """Start timing the current request (in the request middleware)."""
+    timing = RequestTiming(keep_calls)
+    _current.set(timing)
+    return timing
+
+
+def detach():
+    """
+    Stop adding to the current request's timing, in a task that outlives the request
+    (tasks copy the contextvars of the request that created them).
+    """
+    _current.set(None)
+
+
+def add(kind: str, name: str, seconds: float):
+    """Add a call (kind is "db" or "spotify") to the current request's timing."""
+    if (timing := _current.get()) is not None:
+        timing.add(kind, name, seconds)
+
+
+def timed_db_methods(cls):
+    """
+    Class decorator to add the duration of the public async methods
+    to the current request's timing, as db time.
+    """
+
+    for name, func in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.iscoroutinefunction(func):
+            continue
+
+        setattr(cls, name, _timed_db(func, name))
+
+    return cls
+
+
+def _timed_db(func, name: str):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if _current.get() is None or _in_db.get():
+            return await func(*args, **kwargs)
+
+        token = _in_db.set(True)
+        began = time.perf_counter()
+
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _in_db.reset(token)
+            add("db", name, time.perf_counter() - began)
+
+    return wrapper
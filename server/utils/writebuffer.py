@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import typing
+
+from server.utils.metrics import WRITE_BUFFER_DROPPED
+
+_EVENTS_DROPPED = WRITE_BUFFER_DROPPED.labels("events")
+
+
+class WriteBuffer:
+    """
+    Collects the events in memory and writes them in batches,
+    when `max_size` events are pending or every `interval` seconds.
+    The writing itself is done by the `flush_events(records)` callback.
+
+    Start it in an async context and close it on shutdown (flushes what's left).
+    """
+
+    def __init__(
+        self,
+        flush_events: typing.Callable[[list[tuple]], typing.Awaitable],
+        max_size: int = 500,
+        interval: float = 5,
+    ):
+        self.flush_events = flush_events
+        self.max_size = max_size
+        self.interval = interval
+
+        self.events: list[tuple] = []
+
+        # the events of the last failed flush, retried once by the next flush
+        self._retry_events: list[tuple] = []
+
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._flushing: set[asyncio.Task] = set()
+
+    @classmethod
+    def from_config(cls, config, flush_events) -> "WriteBuffer":
+        return cls(
+            flush_events,
+            max_size=config.getint("write_buffer", "max_size", fallback=500),
+            interval=config.getfloat("write_buffer", "interval", fallback=5),
+        )
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def _added(self):
+        if len(self) >= self.max_size and not self._lock.locked():
+            task = asyncio.create_task(self.flush())
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+
+    def add_event(self, record: tuple):
+        self.events.append(record)
+        self._added()
+
+    async def flush(self):
+        async with self._lock:
+            events, self.events = self.events, []
+            retried, self._retry_events = self._retry_events, []
+
+            try:
+                if retried or events:
+                    await self.flush_events(retried + events)
+            except Exception:
+                # retry a batch once and then drop it
+                logging.exception(
+                    f"Failed to write {len(retried) + len(events)} events, "
+                    f"{len(retried)} dropped, {len(events)} retrying later"
+                )
+                self._drop_events(retried)
+                self._retry_events = events
+
+    @staticmethod
+    def _drop_events(events: list[tuple]):
+        if events:
+            _EVENTS_DROPPED.inc(len(events))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            # shielded, so close() never cancels a flush in the middle
+            await asyncio.shield(self.flush())
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        await asyncio.gather(*self._flushing, return_exceptions=True)
+        await self.flush()
+
+        # failed on the last flush, nothing will retry them
+        if self._retry_events:
+            logging.error(f"Dropped {len(self._retry_events)} events on close")
+            self._drop_events(self._retry_events)
+            self._retry_events = []
@@ -0,0 +1,149 @@
+import argparse
+import asyncio
+import collections
+import logging
+import os
+import signal
+import socket
+import time
+
+from server import config
+from server.database import Database
+from server.jobs import JobQueue, FEATURE_ACTIONS
+from server.models.context import Context
+from server.utils import spotify as sp
+from server.utils.tasks import TaskRunner
+from server.utils.sessions import Sessions
+
+
+class Worker:
+    """
+    Background worker that drains the `jobs` queue.
+
+    Run as many of these as needed, on any machine that can reach the database:
+      python -m server.worker --mode prod
+    """
+
+    def __init__(self, config, mode: str = "dev", worker_id: str = None):
+        self.config = config
+        self.mode = mode
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+
+        self.batch_size = config.getint("jobs", "batch_size", fallback=20)
+        self.poll_interval = config.getfloat("jobs", "poll_interval", fallback=5)
+        self.reap_interval = 60
+        self._last_reap = 0.0
+
+        self.ctx: Context = None  # created in setup
+        self.queue: JobQueue = None  # created in setup
+        self.runner: TaskRunner = None  # created in setup
+
+        self._stop = asyncio.Event()
+
+    async def setup(self):
+        server_section = "app" if self.mode == "dev" else "prod_app"
+
+        db = await Database.connect(self.config)
+        sessions = Sessions.from_config(self.config)
+        spotify = sp.Spotify.from_config(
+            self.config, self.config.get(server_section, "server_url"), db, sessions
+        )
+
+        self.ctx = Context(app=self, db=db, spotify=spotify, sessions=sessions)
+        self.queue = JobQueue.from_config(db.pool, self.config)
+        self.runner = TaskRunner.from_config(self.ctx, self.config)
+
+        if self.runner.timeout >= self.queue.visibility_timeout:
+            logging.warning(
+                "tasks.user_timeout should be lower than jobs.visibility_timeout, "
+                "otherwise slow jobs may run twice"
+            )
+
+    async def close(self):
+        await self.ctx.sessions.close()
+        await self.ctx.db.close()
+
+    def stop(self):
+        logging.info(f"Stopping worker {self.worker_id}")
+        self._stop.set()
+
+    async def drain_once(self) -> int:
+        """
+        Claim a batch of jobs and run them.
+        Returns the number of claimed jobs.
+        """
+
+        jobs = await self.queue.claim(self.worker_id, self.batch_size)
+
+        if not jobs:
+            return 0
+
+        by_feature = collections.defaultdict(list)
+        for job in jobs:
+            by_feature[job["feature"]].append(job)
+
+        for feature, feature_jobs in by_feature.items():
+            users = await self.ctx.db.get_users(
+                [j["user_id"] for j in feature_jobs], feature
+            )
+
+            result = await self.runner.run(
+                feature, users.values(), FEATURE_ACTIONS[feature]
+            )
+
+            for job in feature_jobs:
+                if job["user_id"] in result.failed:
+                    error = result.failed[job["user_id"]]
+                    await self.queue.fail(
+                        job["id"],
+                        self.worker_id,
+                        f"{error.__class__.__name__}: {error}",
+                    )
+                else:
+                    # users that were deleted meanwhile are done as well
+                    await self.queue.complete(job["id"], self.worker_id)
+
+        return len(jobs)
+
+    async def run_forever(self):
+        logging.info(f"Worker {self.worker_id} started")
+
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - self._last_reap > self.reap_interval:
+                    await self.queue.reap()
+                    self._last_reap = time.monotonic()
+
+                claimed = await self.drain_once()
+            except Exception as e:
+                logging.error("Worker iteration failed", exc_info=e)
+                claimed = 0
+
+            if claimed < self.batch_size:
+                # queue is drained, wait for more jobs (or for the stop signal)
+                try:
+                    await asyncio.wait_for(self._stop.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+
+async def main(mode: str):
+    worker = Worker(config, mode=mode)
+    await worker.setup()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+
+    try:
+        await worker.run_forever()
+    finally:
+        await worker.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Muzee background jobs worker")
+    parser.add_argument("--mode", choices=("dev", "prod"), default="dev")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.mode))